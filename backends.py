@@ -0,0 +1,284 @@
+"""
+One API over the Python, NumPy and Cython backends.
+
+    import backends
+    edges = backends.apply_sobel(image)                        # fastest available backend
+    blurred = backends.apply_gaussian(image, 9, 3, backend="numpy")
+    backends.available()                                       # e.g. ["numpy", "cython", "python"]
+
+Every function takes a uint8 H x W or H x W x C array, the same
+parameters whatever the backend, and returns a uint8 array of the same
+shape; the pure-Python backend is adapted through FlatImage and kernel
+tuples. Its median gets the image with reflected borders, so it matches
+the other two at the edges too, and it has no fast Gaussian: mode="fast"
+runs the exact kernel there.
+
+backend="auto" uses the backend predicted fastest for the filter and
+image size. The prediction is a fixed cost plus a cost per pixel for
+every backend and filter, fitted from a short calibration run on two
+small synthetic images and cached in CALIBRATION_FILE per machine and
+interpreter. It is a heuristic: the model ignores the filter parameters
+(kernel size, sigma, Gaussian mode, median window), is fitted with the
+default ones, and extrapolates from CALIBRATION_SIZES, which stay small
+so the pure-Python backend calibrates in about a second. For large
+kernels or images, or whenever the choice matters, name the backend.
+"""
+
+import importlib
+import importlib.machinery
+import json
+import os
+import pathlib
+import platform
+import sys
+import threading
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from kernels import gaussian_mode
+
+BACKEND_MODULES = {"numpy": "process_image_numpy", "cython": "process_image_cython", "python": "process_image_python"}
+FILTERS = ("sobel", "gaussian", "median")
+CALIBRATION_FILE = pathlib.Path(".cache") / "calibration.json"
+# Side lengths of the synthetic calibration images
+CALIBRATION_SIZES = (48, 144)
+CALIBRATION_REPEATS = 3
+# Side length of the image the warm-up filters
+WARM_UP_SIZE = 32
+
+# In-process copy of the calibration of this machine
+_calibration = None
+
+
+class _ArrayBackend:
+    """Adapter of process_image_numpy / process_image_cython to the common signatures."""
+
+    def __init__(self, name: str, module):
+        self.name = name
+        self.module = module
+
+    def sobel(self, image: np.ndarray, magnitude: str = "exact") -> np.ndarray:
+        return self.module.apply_sobel(image, magnitude=magnitude)
+
+    def gaussian(self, image: np.ndarray, size: int = 9, sigma: float = 3, mode: str = "exact") -> np.ndarray:
+        return self.module.apply_gaussian(image, size, sigma, mode)
+
+    def median(self, image: np.ndarray, size: int = 3) -> np.ndarray:
+        return self.module.apply_median_filter(image, size)
+
+
+class _PythonBackend(_ArrayBackend):
+    """Adapter of process_image_python: arrays go in and out through FlatImage."""
+
+    def _run(self, image: np.ndarray, func) -> np.ndarray:
+        channels = image.shape[2] if image.ndim == 3 else 1
+        result = func(self.module.FlatImage(image.shape[1], image.shape[0], image.tobytes(), channels))
+        return np.frombuffer(result.data, dtype=np.uint8).reshape(image.shape)
+
+    def sobel(self, image: np.ndarray, magnitude: str = "exact") -> np.ndarray:
+        return self._run(image, lambda flat: self.module.apply_sobel(flat, magnitude))
+
+    def gaussian(self, image: np.ndarray, size: int = 9, sigma: float = 3, mode: str = "exact") -> np.ndarray:
+        gaussian_mode(mode)
+        kernel = self.module.create_gaussian_kernel(size, sigma, separable=True)
+        return self._run(image, lambda flat: self.module.apply_gaussian(flat, kernel))
+
+    def median(self, image: np.ndarray, size: int = 3) -> np.ndarray:
+        # The Python median pads with zeros: reflecting the borders first, as the other
+        # backends do, and cropping leaves it no window that reaches its own padding
+        if image.size == 0:
+            return image.copy()
+        pad = size // 2
+        reflected = np.pad(image, ((pad, pad), (pad, pad)) + ((0, 0),) * (image.ndim - 2), mode="symmetric")
+        # The window side is the length of the kernel sequence
+        result = self._run(reflected, lambda flat: self.module.apply_median_filter(flat, (1,) * size))
+        return result[pad:pad + image.shape[0], pad:pad + image.shape[1]]
+
+
+def _unavailable_reason(name: str):
+    """Why a backend cannot be imported, or None if it can."""
+    module_name = BACKEND_MODULES[name]
+    try:
+        importlib.import_module(module_name)
+    except ImportError as error:
+        if name != "cython":
+            return str(error)
+        # A compiled module built for another interpreter is simply not found
+        builds = sorted(path.name for path in pathlib.Path(__file__).resolve().parent.glob(module_name + ".*")
+                        if path.suffix in (".so", ".pyd"))
+        if builds:
+            return (f"no build for this interpreter (needs '{importlib.machinery.EXTENSION_SUFFIXES[0]}', "
+                    f"found {', '.join(builds)}); run python setup.py build_ext --inplace")
+        return f"{error}; run python setup.py build_ext --inplace"
+    return None
+
+
+@lru_cache(maxsize=1)
+def _status() -> dict:
+    return {name: _unavailable_reason(name) for name in BACKEND_MODULES}
+
+
+def available() -> list:
+    """Names of the backends importable in this interpreter, fastest kind first."""
+    return [name for name, reason in _status().items() if reason is None]
+
+
+def unavailable() -> dict:
+    """Backend name -> reason it cannot be used."""
+    return {name: reason for name, reason in _status().items() if reason is not None}
+
+
+@lru_cache(maxsize=None)
+def get_backend(name: str):
+    """The adapter of one backend ("python", "numpy" or "cython")."""
+    if name not in BACKEND_MODULES:
+        raise ValueError(f"unknown backend '{name}', expected one of {sorted(BACKEND_MODULES)}")
+    # Only this backend: importing the others would slow down a cold start that needs one
+    reason = _unavailable_reason(name)
+    if reason is not None:
+        raise ImportError(f"backend '{name}' is not available: {reason}")
+    adapter = _PythonBackend if name == "python" else _ArrayBackend
+    return adapter(name, importlib.import_module(BACKEND_MODULES[name]))
+
+
+def warm_up(names: list = None) -> None:
+    """
+    Runs every filter once on a tiny image with each backend (all available
+    ones by default), so lazy imports such as scipy.ndimage, the kernel
+    cache and the Sobel square-root table are ready before the first request.
+    """
+    image = np.zeros((WARM_UP_SIZE, WARM_UP_SIZE), dtype=np.uint8)
+    for name in available() if names is None else names:
+        adapter = get_backend(name)
+        for filter_name in FILTERS:
+            getattr(adapter, filter_name)(image)
+
+
+def warm_up_in_background(names: list = None) -> threading.Thread:
+    """Starts warm_up in a daemon thread and returns it (join() waits for it)."""
+    thread = threading.Thread(target=warm_up, args=(names,), name="backend-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def _fingerprint() -> str:
+    """Identifies the machine and interpreter a calibration is valid for."""
+    return "|".join([platform.node(), platform.machine(), str(os.cpu_count()),
+                     sys.implementation.cache_tag, np.__version__])
+
+
+def calibrate(filters: tuple = FILTERS, sizes: tuple = CALIBRATION_SIZES,
+              repeats: int = CALIBRATION_REPEATS) -> dict:
+    """
+    Times every available backend on synthetic images of the two sizes and
+    returns {filter: {backend: [fixed seconds, seconds per pixel]}}.
+    """
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 256, (side, side), dtype=np.uint8) for side in sizes]
+    pixels = [image.size for image in images]
+    model = {}
+    for filter_name in filters:
+        model[filter_name] = {}
+        for name in available():
+            func = getattr(get_backend(name), filter_name)
+            seconds = []
+            for image in images:
+                func(image)  # warm-up: imports, kernel cache, first-touch allocations
+                samples = []
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    func(image)
+                    samples.append(time.perf_counter() - start)
+                seconds.append(min(samples))
+            per_pixel = max((seconds[1] - seconds[0]) / (pixels[1] - pixels[0]), 0.0)
+            model[filter_name][name] = [max(seconds[0] - per_pixel * pixels[0], 0.0), per_pixel]
+    return model
+
+
+def _complete(model) -> bool:
+    """Whether a calibration covers every filter on every available backend."""
+    return model is not None and all(
+        name in model.get(filter_name, {}) for filter_name in FILTERS for name in available())
+
+
+def load_calibration(path=CALIBRATION_FILE, recalibrate: bool = False) -> dict:
+    """
+    The calibration of this machine: from memory, else from the file at
+    path, else measured now and saved there. Backends added since the
+    last run (e.g. a fresh Cython build) trigger a new calibration.
+    """
+    global _calibration
+    key = _fingerprint()
+    if not recalibrate and _complete(_calibration):
+        return _calibration
+
+    path = pathlib.Path(path)
+    try:
+        stored = json.loads(path.read_text())
+    except (OSError, ValueError):
+        stored = {}
+    model = None if recalibrate else stored.get(key)
+    if not _complete(model):
+        model = calibrate()
+        stored[key] = model
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(stored, indent=2))
+        except OSError:
+            pass  # read-only checkout: keep the calibration for this process only
+    _calibration = model
+    return model
+
+
+def choose_backend(filters, shape: tuple) -> str:
+    """
+    Name of the backend predicted fastest for a filter name, or a list of
+    filter names run one after the other, on an image of the given shape
+    (with the default filter parameters; see the module docstring).
+    """
+    filters = [filters] if isinstance(filters, str) else list(filters)
+    for filter_name in filters:
+        if filter_name not in FILTERS:
+            raise ValueError(f"unknown filter '{filter_name}', expected one of {FILTERS}")
+    pixels = int(np.prod(shape))
+    model = load_calibration()
+    return min(available(), key=lambda name: sum(
+        model[f][name][0] + model[f][name][1] * pixels for f in filters))
+
+
+def apply(filter_name: str, image, backend: str = "auto", **params) -> np.ndarray:
+    """
+    Applies "sobel", "gaussian" or "median" with one backend, or the
+    predicted fastest with backend="auto". Non-uint8 input is clipped to
+    0-255 and converted first.
+    """
+    if filter_name not in FILTERS:
+        raise ValueError(f"unknown filter '{filter_name}', expected one of {FILTERS}")
+    image = np.asarray(image)
+    if image.dtype != np.uint8:
+        image = np.clip(image, 0, 255).astype(np.uint8)
+    if backend == "auto":
+        backend = choose_backend(filter_name, image.shape)
+    return getattr(get_backend(backend), filter_name)(image, **params)
+
+
+def apply_sobel(image, magnitude: str = "exact", backend: str = "auto") -> np.ndarray:
+    return apply("sobel", image, backend, magnitude=magnitude)
+
+
+def apply_gaussian(image, size: int = 9, sigma: float = 3, mode: str = "exact", backend: str = "auto") -> np.ndarray:
+    return apply("gaussian", image, backend, size=size, sigma=sigma, mode=mode)
+
+
+def apply_median(image, size: int = 3, backend: str = "auto") -> np.ndarray:
+    return apply("median", image, backend, size=size)
+
+
+if __name__ == "__main__":
+    for name, reason in unavailable().items():
+        print(f"{name}: unavailable ({reason})")
+    for filter_name, timings in load_calibration(recalibrate="--recalibrate" in sys.argv).items():
+        print(filter_name + ": " + ", ".join(
+            f"{name} {fixed * 1e3:.2f} ms + {per_pixel * 1e9:.1f} ns/px" for name, (fixed, per_pixel) in timings.items()))
@@ -0,0 +1,279 @@
+"""
+Batch filtering of image folders from the command line.
+
+    python batch_process.py photos/ "scans/*.png" -o filtered/ \
+        --chain median:size=3,gaussian:size=9:sigma=3,sobel --backend numpy --workers 8
+
+Images flow through three overlapped stages connected by bounded queues:
+decode threads -> filter workers (a process pool) -> encode threads, so
+disk I/O, JPEG decoding/encoding and filtering run at the same time while
+only a bounded number of images is held in memory.
+"""
+
+import argparse
+import glob
+import os
+import pathlib
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import backends
+from image_io import open_image
+from kernels import GAUSSIAN_MODES, SOBEL_MAGNITUDES
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".pgm", ".webp"}
+# "auto" picks the backend predicted fastest for each image (see backends.py)
+BACKENDS = ["numpy", "cython", "python", "auto"]
+COLOR_MODES = ["L", "RGB", "RGBA"]
+FILTER_PARAMS = {"sobel": ("magnitude",), "gaussian": ("size", "sigma", "mode"), "median": ("size",)}
+
+# Marks the end of a queue's stream
+_DONE = object()
+
+
+def parse_chain(spec: str) -> list:
+    """Parses 'median:size=3,gaussian:sigma=8:mode=fast,sobel:magnitude=l1' into [(name, params), ...]."""
+    chain = []
+    for step in filter(None, (part.strip() for part in spec.split(","))):
+        name, *options = step.split(":")
+        if name not in FILTER_PARAMS:
+            raise ValueError(f"unknown filter '{name}', expected one of {sorted(FILTER_PARAMS)}")
+        params = {}
+        for option in options:
+            key, _, value = option.partition("=")
+            if key not in FILTER_PARAMS[name]:
+                raise ValueError(f"filter '{name}' has no parameter '{key}'")
+            if key == "magnitude":
+                if value not in SOBEL_MAGNITUDES:
+                    raise ValueError(f"unknown magnitude '{value}', expected one of {SOBEL_MAGNITUDES}")
+                params[key] = value
+            elif key == "mode":
+                if value not in GAUSSIAN_MODES:
+                    raise ValueError(f"unknown Gaussian mode '{value}', expected one of {GAUSSIAN_MODES}")
+                params[key] = value
+            else:
+                params[key] = float(value) if key == "sigma" else int(value)
+        chain.append((name, params))
+    if not chain:
+        raise ValueError("the filter chain is empty")
+    return chain
+
+
+def apply_chain(backend: str, chain: list, pixels: np.ndarray) -> np.ndarray:
+    """Runs the filter chain on a uint8 H x W or H x W x C array with one backend; returns uint8."""
+    if backend == "auto":
+        backend = backends.choose_backend([name for name, _ in chain], pixels.shape)
+    if backend == "python":
+        adapter = backends.get_backend("python")
+        for name, params in chain:
+            pixels = getattr(adapter, name)(pixels, **params)
+        return pixels
+
+    from pipeline import Pipeline
+    if backend == "cython":
+        import process_image_cython as module
+    else:
+        import process_image_numpy as module
+    # Both array backends take uint8 as is and return uint8
+    return Pipeline(chain, module).run(pixels)
+
+
+def _glob_root(pattern: str) -> pathlib.Path:
+    """The leading directories of a glob pattern that hold no wildcard ('scans' for 'scans/**/*.jpg')."""
+    parts = pathlib.Path(pattern).parts
+    literal = []
+    for part in parts[:-1]:
+        if glob.has_magic(part):
+            break
+        literal.append(part)
+    return pathlib.Path(*literal) if literal else pathlib.Path(".")
+
+
+def find_images(inputs: list) -> list:
+    """
+    Expands directories (recursively) and glob patterns into (path, relative
+    output name) pairs. Names are relative to the directory, or to the
+    wildcard-free root of the pattern, so files from different subfolders
+    keep apart.
+    """
+    found = []
+    for item in inputs:
+        if os.path.isdir(item):
+            root = pathlib.Path(item)
+            for path in sorted(root.rglob("*")):
+                if path.suffix.lower() in IMAGE_EXTENSIONS and path.is_file():
+                    found.append((path, path.relative_to(root)))
+        else:
+            root = _glob_root(item)
+            for match in sorted(glob.glob(item, recursive=True)):
+                path = pathlib.Path(match)
+                if path.suffix.lower() in IMAGE_EXTENSIONS and path.is_file():
+                    found.append((path, path.relative_to(root)))
+    return found
+
+
+def _output_path(output_root: pathlib.Path, relative: pathlib.Path, output_format: str = None) -> pathlib.Path:
+    target = output_root / relative
+    return target.with_suffix("." + output_format.lstrip(".")) if output_format else target
+
+
+def _check_unique_outputs(images: list, output_root: pathlib.Path, output_format: str = None) -> None:
+    """Raises ValueError when two inputs would be written to the same output file."""
+    sources = {}
+    for path, relative in images:
+        target = _output_path(output_root, relative, output_format)
+        if target in sources:
+            raise ValueError(f"{sources[target]} and {path} would both be written to {target}")
+        sources[target] = path
+
+
+def _run_stage(func, inbox: queue.Queue, outbox, threads: int, errors: list) -> list:
+    """
+    Starts threads that apply func to every item of inbox and forward the
+    result to outbox. Each thread stops at a _DONE marker.
+    """
+    def loop():
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                return
+            try:
+                result = func(item)
+            except Exception as error:  # keep the batch going, report at the end
+                errors.append((item[0], error))
+                continue
+            if outbox is not None:
+                outbox.put(result)
+
+    workers = [threading.Thread(target=loop, daemon=True) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+def _finish_stage(workers: list, outbox, next_threads: int) -> None:
+    """Waits for a stage to drain and tells every thread of the next stage to stop."""
+    for worker in workers:
+        worker.join()
+    if outbox is not None:
+        for _ in range(next_threads):
+            outbox.put(_DONE)
+
+
+def process_batch(inputs: list, output_dir: str, chain: list, backend: str = "numpy",
+                  workers: int = None, io_threads: int = 4, queue_size: int = 16,
+                  output_format: str = None, mode: str = "L", max_size=None,
+                  save_options: dict = None) -> dict:
+    """
+    Filters every image found in inputs and writes it under output_dir.
+    workers is the size of the filter process pool (0 filters in the
+    calling process). mode is the PIL mode images are decoded to: "L"
+    for grayscale, or "RGB" / "RGBA" to filter every channel. max_size
+    shrinks every image to fit that box as it is decoded (see
+    image_io.open_image), and save_options go to PIL's Image.save.
+    Returns counts, elapsed seconds, images/s and errors. Raises
+    ValueError, before filtering anything, if two inputs map to the same
+    output file.
+    """
+    images = find_images(inputs)
+    output_root = pathlib.Path(output_dir)
+    _check_unique_outputs(images, output_root, output_format)
+    if backend == "auto":
+        # Calibrate (or load the calibration) once, before the workers need it
+        backends.load_calibration()
+    workers = os.cpu_count() or 1 if workers is None else workers
+    filter_threads = max(workers, 1)
+    errors = []
+
+    paths = queue.Queue()
+    decoded = queue.Queue(maxsize=queue_size)
+    filtered = queue.Queue(maxsize=queue_size)
+    for item in images:
+        paths.put(item)
+    for _ in range(io_threads):
+        paths.put(_DONE)
+
+    def decode(item):
+        path, relative = item
+        return path, relative, np.asarray(open_image(path, mode, max_size))
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+
+    def run_filters(item):
+        path, relative, pixels = item
+        if pool is None:
+            return path, relative, apply_chain(backend, chain, pixels)
+        return path, relative, pool.submit(apply_chain, backend, chain, pixels).result()
+
+    def encode(item):
+        path, relative, pixels = item
+        target = _output_path(output_root, relative, output_format)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        Image.fromarray(pixels).save(target, **(save_options or {}))
+
+    start_time = time.perf_counter()
+    try:
+        decoders = _run_stage(decode, paths, decoded, io_threads, errors)
+        filterers = _run_stage(run_filters, decoded, filtered, filter_threads, errors)
+        encoders = _run_stage(encode, filtered, None, io_threads, errors)
+        _finish_stage(decoders, decoded, filter_threads)
+        _finish_stage(filterers, filtered, io_threads)
+        _finish_stage(encoders, None, 0)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    elapsed = time.perf_counter() - start_time
+
+    done = len(images) - len(errors)
+    return {
+        "images": done,
+        "failed": len(errors),
+        "seconds": elapsed,
+        "images_per_second": done / elapsed if elapsed > 0 else 0.0,
+        "errors": errors,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Apply a filter chain to many images.")
+    parser.add_argument("inputs", nargs="+", help="directories (searched recursively) or glob patterns")
+    parser.add_argument("-o", "--output-dir", required=True)
+    parser.add_argument("--chain", default="sobel",
+                        help="comma-separated filters, e.g. median:size=3,gaussian:size=9:sigma=3,sobel")
+    parser.add_argument("--backend", choices=BACKENDS, default="numpy")
+    parser.add_argument("--workers", type=int, default=None, help="filter processes (default: one per core)")
+    parser.add_argument("--io-threads", type=int, default=4, help="decode and encode threads each")
+    parser.add_argument("--queue-size", type=int, default=16, help="images buffered between stages")
+    parser.add_argument("--format", dest="output_format", help="output extension, e.g. png (default: keep)")
+    parser.add_argument("--mode", choices=COLOR_MODES, default="L", help="filter in grayscale or per color channel")
+    parser.add_argument("--max-size", type=int, help="shrink images to fit this many pixels a side while decoding")
+    parser.add_argument("--compress-level", type=int, choices=range(10), metavar="0-9",
+                        help="PNG compression (1 encodes several times faster than the default 6)")
+    args = parser.parse_args()
+
+    try:
+        chain = parse_chain(args.chain)
+    except ValueError as error:
+        parser.error(str(error))
+
+    try:
+        report = process_batch(args.inputs, args.output_dir, chain, args.backend, args.workers,
+                               args.io_threads, args.queue_size, args.output_format, args.mode, args.max_size,
+                               None if args.compress_level is None else {"compress_level": args.compress_level})
+    except ValueError as error:
+        parser.error(str(error))
+    for path, error in report["errors"]:
+        print(f"Failed {path}: {error}", file=sys.stderr)
+    print(f"Processed {report['images']} images in {report['seconds']:.2f}s "
+          f"({report['images_per_second']:.2f} images/s), {report['failed']} failed")
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+"""
+In-process benchmark of the Python, NumPy and Cython backends.
+
+The image is decoded once and each backend's filter functions are called
+directly, so the reported times cover the filter work only: no
+interpreter start-up, imports, temporary files or JPEG round trips.
+
+Every measurement uses perf_counter_ns with warm-up runs and repeats,
+and reports median, p95, standard deviation and megapixels per second.
+`python benchmark.py sweep` times the filters over a range of image and
+kernel sizes to show how each backend scales.
+"""
+
+import argparse
+import csv
+import importlib
+import statistics
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+from PIL import Image
+
+import backends
+
+FILTER_NAMES = ["Sobel", "Gaussian", "Median Noise-reduction"]
+BACKEND_NAMES = ["Python", "Numpy", "Cython"]
+
+GAUSSIAN_SIZE = 9
+GAUSSIAN_SIGMA = 3
+MEDIAN_SIZE = 3
+
+# Parameters each filter runs with, part of the result cache key
+FILTER_PARAMS = {
+    "Sobel": {},
+    "Gaussian": {"size": GAUSSIAN_SIZE, "sigma": GAUSSIAN_SIGMA},
+    "Median Noise-reduction": {"size": MEDIAN_SIZE},
+}
+
+# Default sweep: 256² to 8K² images, small to large kernels
+SWEEP_SIZES = [256, 512, 1024, 2048, 4096, 8192]
+SWEEP_KERNEL_SIZES = [3, 9, 15, 31]
+# The pure-Python backend takes minutes beyond this side length
+PYTHON_MAX_SIZE = 512
+
+
+@dataclass
+class TimingStats:
+    """Summary of repeated timings of one call, in seconds."""
+    samples_ns: list
+    pixels: int
+
+    @property
+    def median(self) -> float:
+        return statistics.median(self.samples_ns) / 1e9
+
+    @property
+    def p95(self) -> float:
+        return float(np.percentile(self.samples_ns, 95)) / 1e9
+
+    @property
+    def stdev(self) -> float:
+        return statistics.stdev(self.samples_ns) / 1e9 if len(self.samples_ns) > 1 else 0.0
+
+    @property
+    def megapixels_per_s(self) -> float:
+        return self.pixels / 1e6 / self.median if self.median > 0 else float('inf')
+
+
+@dataclass
+class FilterResult:
+    """Timing and output of one filter run on one backend."""
+    filter: str
+    backend: str
+    seconds: float  # median over the repeats
+    image: np.ndarray  # uint8 grayscale output
+    stats: TimingStats = None
+    cached: bool = False  # served from a ResultCache
+
+
+@dataclass
+class SweepResult:
+    """Timing of one (backend, filter, image size, kernel size) point of a sweep."""
+    backend: str
+    filter: str
+    size: int
+    kernel_size: int
+    stats: TimingStats = field(repr=False)
+
+    def as_row(self) -> dict:
+        return {
+            'Backend': self.backend,
+            'Filter Type': self.filter,
+            'Image Size': self.size,
+            'Kernel Size': self.kernel_size,
+            'Repeats': len(self.stats.samples_ns),
+            'Median (seconds)': self.stats.median,
+            'P95 (seconds)': self.stats.p95,
+            'Stdev (seconds)': self.stats.stdev,
+            'Throughput (MP/s)': self.stats.megapixels_per_s,
+        }
+
+
+def _python_filters(module, gaussian_size=GAUSSIAN_SIZE, gaussian_sigma=GAUSSIAN_SIGMA,
+                    median_size=MEDIAN_SIZE) -> dict:
+    return {
+        "Sobel": module.apply_sobel,
+        "Gaussian": lambda img: module.apply_gaussian(
+            img, module.create_gaussian_kernel(gaussian_size, sigma=gaussian_sigma)),
+        "Median Noise-reduction": lambda img: module.apply_median_filter(img, (median_size, median_size)),
+    }
+
+def _array_filters(module, gaussian_size=GAUSSIAN_SIZE, gaussian_sigma=GAUSSIAN_SIGMA,
+                   median_size=MEDIAN_SIZE) -> dict:
+    return {
+        "Sobel": module.apply_sobel,
+        "Gaussian": lambda img: module.apply_filter(
+            img, module.create_gaussian_kernel(gaussian_size, sigma=gaussian_sigma)),
+        "Median Noise-reduction": lambda img: module.apply_median_filter(img, median_size),
+    }
+
+# Backend name -> (module, input conversion mirroring its read_image, filter table)
+_BACKENDS = {
+    "Python": ("process_image_python",
+               lambda gray: importlib.import_module("process_image_python").FlatImage(
+                   gray.size[0], gray.size[1], gray.tobytes()),
+               _python_filters),
+    "Numpy": ("process_image_numpy", np.asarray, _array_filters),
+    "Cython": ("process_image_cython", np.asarray, _array_filters),
+}
+
+
+def available_backends() -> list:
+    """Backends whose module can be imported (Cython needs the compiled extension)."""
+    usable = backends.available()
+    return [name for name in BACKEND_NAMES if name.lower() in usable]
+
+
+def to_grayscale(image) -> Image.Image:
+    """Accepts a PIL image or a path and returns it as an 8-bit grayscale PIL image."""
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+    return image.convert('L')
+
+
+def as_uint8_array(output) -> np.ndarray:
+    """Converts a backend's output (ndarray or process_image_python.FlatImage) to a uint8 array."""
+    if not isinstance(output, np.ndarray) and hasattr(output, "width"):
+        return np.frombuffer(output.data, dtype=np.uint8).reshape(output.height, output.width).copy()
+    return np.clip(np.asarray(output), 0, 255).astype(np.uint8)
+
+
+def measure(func, data, pixels: int, warmup: int = 1, repeats: int = 5):
+    """
+    Calls func(data) warmup times untimed, then repeats times timed.
+    Returns (TimingStats, output of the last call).
+    """
+    for _ in range(warmup):
+        func(data)
+    samples = []
+    output = None
+    for _ in range(max(repeats, 1)):
+        start_time = time.perf_counter_ns()
+        output = func(data)
+        samples.append(time.perf_counter_ns() - start_time)
+    return TimingStats(samples, pixels), output
+
+
+def run_benchmark(image, backends: list = None, filters: list = None,
+                  warmup: int = 0, repeats: int = 1, cache=None) -> list:
+    """
+    Runs every filter on every backend and returns a list of FilterResult.
+    image is a PIL image or a path; backends and filters default to all
+    available ones. With a result_cache.ResultCache, results already seen
+    for the same pixels and parameters are returned without recomputing.
+    """
+    gray = to_grayscale(image)
+    pixels = gray.size[0] * gray.size[1]
+    digest = None
+    if cache is not None:
+        from result_cache import cache_key, image_digest, module_version
+        digest = image_digest(gray)
+    results = []
+    for backend in backends or available_backends():
+        module_name, to_input, filter_table = _BACKENDS[backend]
+        table = None
+        data = None
+        for filter_name in filters or FILTER_NAMES:
+            if cache is not None:
+                key = cache_key(digest, backend, filter_name, FILTER_PARAMS[filter_name], module_version(module_name))
+                hit = cache.get(key)
+                if hit is not None:
+                    results.append(FilterResult(filter_name, backend, hit[1], hit[0], cached=True))
+                    continue
+            if table is None:
+                table = filter_table(importlib.import_module(module_name))
+                data = to_input(gray)
+            stats, output = measure(table[filter_name], data, pixels, warmup, repeats)
+            pixels_out = as_uint8_array(output)
+            results.append(FilterResult(filter_name, backend, stats.median, pixels_out, stats))
+            if cache is not None:
+                cache.put(key, pixels_out, stats.median)
+    return results
+
+
+def run_sweep(image, backends: list = None, filters: list = None, sizes: list = None,
+              kernel_sizes: list = None, warmup: int = 1, repeats: int = 5,
+              python_max_size: int = PYTHON_MAX_SIZE) -> list:
+    """
+    Times every filter over square resizes of image and over kernel sizes
+    (Gaussian with sigma = size / 3, median of size x size; Sobel is fixed
+    at 3x3). Returns a list of SweepResult.
+    """
+    gray = to_grayscale(image)
+    kernel_sizes = kernel_sizes or SWEEP_KERNEL_SIZES
+    results = []
+    for size in sizes or SWEEP_SIZES:
+        resized = gray.resize((size, size), Image.BILINEAR)
+        for backend in backends or available_backends():
+            if backend == "Python" and size > python_max_size:
+                continue
+            module_name, to_input, filter_table = _BACKENDS[backend]
+            module = importlib.import_module(module_name)
+            data = to_input(resized)
+            for kernel_size in kernel_sizes:
+                table = filter_table(module, kernel_size, kernel_size / 3, kernel_size)
+                for filter_name in filters or FILTER_NAMES:
+                    if filter_name == "Sobel" and kernel_size != kernel_sizes[0]:
+                        continue  # Sobel is always 3x3, time it once per image size
+                    stats, _ = measure(table[filter_name], data, size * size, warmup, repeats)
+                    result = SweepResult(backend, filter_name, size,
+                                         3 if filter_name == "Sobel" else kernel_size, stats)
+                    print(f"{backend:<8} {filter_name:<24} {size:>5}² k={result.kernel_size:<3} "
+                          f"median {stats.median:>9.4f}s  p95 {stats.p95:>9.4f}s  "
+                          f"sd {stats.stdev:>8.4f}s  {stats.megapixels_per_s:>9.1f} MP/s")
+                    results.append(result)
+    return results
+
+
+def timings_by_filter(results: list) -> dict:
+    """Groups results as {filter: {backend: seconds}}."""
+    table = {}
+    for result in results:
+        table.setdefault(result.filter, {})[result.backend] = result.seconds
+    return table
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the image filters of every backend.")
+    parser.add_argument("mode", nargs="?", choices=["single", "sweep"], default="single")
+    parser.add_argument("--image", default="image.jpg")
+    parser.add_argument("--backends", nargs="+", choices=BACKEND_NAMES)
+    parser.add_argument("--filters", nargs="+", choices=FILTER_NAMES)
+    parser.add_argument("--sizes", nargs="+", type=int, default=SWEEP_SIZES)
+    parser.add_argument("--kernel-sizes", nargs="+", type=int, default=SWEEP_KERNEL_SIZES)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--csv", help="write the sweep results to this CSV file")
+    args = parser.parse_args()
+
+    if args.mode == "sweep":
+        results = run_sweep(args.image, args.backends, args.filters, args.sizes,
+                            args.kernel_sizes, args.warmup, args.repeats)
+        if args.csv and results:
+            with open(args.csv, mode='w', newline='') as file:
+                writer = csv.DictWriter(file, fieldnames=list(results[0].as_row()))
+                writer.writeheader()
+                writer.writerows(result.as_row() for result in results)
+            print(f"Sweep results saved to {args.csv}")
+        return
+
+    results = run_benchmark(args.image, args.backends, args.filters, args.warmup, args.repeats)
+    print(f"{'Backend':<8} {'Filter Type':<24} {'Median':>10} {'P95':>10} {'Stdev':>10} {'MP/s':>9}")
+    print("-" * 76)
+    for result in results:
+        stats = result.stats
+        print(f"{result.backend:<8} {result.filter:<24} {stats.median:>9.4f}s {stats.p95:>9.4f}s "
+              f"{stats.stdev:>9.4f}s {stats.megapixels_per_s:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Persistent benchmark history with regression detection.
+
+Each sweep is appended to metrics/history.jsonl, one JSON line per
+(backend, filter, image size, kernel size) point, tagged with a run id,
+the git revision and the machine. `compare` matches a candidate run with
+a baseline run on the same machine and flags points that are slower
+with statistical significance (one-sided Mann-Whitney U test on the raw
+samples) and by more than a minimum relative margin.
+
+    python benchmark_history.py run --sizes 256 1024
+    python benchmark_history.py compare            # last two runs on this machine
+    python benchmark_history.py compare --baseline a1b2c3d
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pathlib
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from dataclasses import dataclass
+
+import benchmark
+
+HISTORY_PATH = pathlib.Path("metrics") / "history.jsonl"
+# Significance level of the Mann-Whitney U test
+ALPHA = 0.01
+# Smallest slowdown of the median worth reporting
+MIN_SLOWDOWN = 0.05
+
+
+@dataclass
+class Comparison:
+    """Baseline vs candidate timing of one benchmark point."""
+    backend: str
+    filter: str
+    size: int
+    kernel_size: int
+    baseline_median: float
+    candidate_median: float
+    p_value: float
+    regression: bool
+
+    @property
+    def ratio(self) -> float:
+        return self.candidate_median / self.baseline_median if self.baseline_median > 0 else float('inf')
+
+
+def machine_info() -> dict:
+    """Description of the host the benchmark ran on."""
+    return {
+        "node": platform.node(),
+        "system": platform.system(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+    }
+
+
+def machine_id(info: dict = None) -> str:
+    """Short stable key for the host, so runs are only compared on like hardware."""
+    info = info or machine_info()
+    return hashlib.sha1(json.dumps(info, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def git_revision() -> str:
+    """Short git revision of the working tree, with '-dirty' for local changes."""
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], check=True,
+                                  capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], check=True,
+                               capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return revision + ("-dirty" if dirty else "")
+
+
+def record(results: list, path: pathlib.Path = HISTORY_PATH, run_id: str = None) -> str:
+    """Appends the SweepResults of one run to the history and returns the run id."""
+    info = machine_info()
+    revision = git_revision()
+    run_id = run_id or f"{time.strftime('%Y%m%dT%H%M%S')}-{revision}-{uuid.uuid4().hex[:4]}"
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, mode='a') as file:
+        for result in results:
+            file.write(json.dumps({
+                "run_id": run_id,
+                "timestamp": time.time(),
+                "revision": revision,
+                "machine": machine_id(info),
+                "machine_info": info,
+                "backend": result.backend,
+                "filter": result.filter,
+                "size": result.size,
+                "kernel_size": result.kernel_size,
+                "samples_ns": result.stats.samples_ns,
+            }) + "\n")
+    return run_id
+
+
+def load(path: pathlib.Path = HISTORY_PATH) -> list:
+    """All history records, oldest first."""
+    path = pathlib.Path(path)
+    if not path.exists():
+        return []
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def run_ids(records: list, machine: str = None) -> list:
+    """Run ids in the order they were recorded, optionally for one machine only."""
+    ids = []
+    for entry in records:
+        if (machine is None or entry["machine"] == machine) and entry["run_id"] not in ids:
+            ids.append(entry["run_id"])
+    return ids
+
+
+def resolve_run(records: list, ref: str, machine: str) -> str:
+    """Finds the latest run on the machine whose run id or revision starts with ref."""
+    for run_id in reversed(run_ids(records, machine)):
+        entry = next(e for e in records if e["run_id"] == run_id)
+        if run_id.startswith(ref) or entry["revision"].startswith(ref):
+            return run_id
+    raise ValueError(f"no run matching '{ref}' on this machine")
+
+
+def compare(records: list, baseline: str, candidate: str,
+            alpha: float = ALPHA, min_slowdown: float = MIN_SLOWDOWN) -> list:
+    """Compares every benchmark point present in both runs."""
+    from scipy.stats import mannwhitneyu
+
+    def points(run_id):
+        return {(e["backend"], e["filter"], e["size"], e["kernel_size"]): e["samples_ns"]
+                for e in records if e["run_id"] == run_id}
+
+    base_points, cand_points = points(baseline), points(candidate)
+    comparisons = []
+    for key in sorted(base_points.keys() & cand_points.keys()):
+        base, cand = base_points[key], cand_points[key]
+        base_median, cand_median = statistics.median(base) / 1e9, statistics.median(cand) / 1e9
+        p_value = float(mannwhitneyu(cand, base, alternative="greater").pvalue)
+        regression = p_value < alpha and cand_median > base_median * (1 + min_slowdown)
+        comparisons.append(Comparison(*key, base_median, cand_median, p_value, regression))
+    return comparisons
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Record benchmark runs and detect regressions.")
+    parser.add_argument("--history", default=str(HISTORY_PATH))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run a benchmark sweep and record it")
+    run.add_argument("--image", default="image.jpg")
+    run.add_argument("--backends", nargs="+", choices=benchmark.BACKEND_NAMES)
+    run.add_argument("--sizes", nargs="+", type=int, default=[256, 1024])
+    run.add_argument("--kernel-sizes", nargs="+", type=int, default=[3, 9])
+    run.add_argument("--warmup", type=int, default=1)
+    run.add_argument("--repeats", type=int, default=10)
+
+    comp = commands.add_parser("compare", help="compare a run against a baseline")
+    comp.add_argument("--baseline", help="run id or git revision (default: previous run)")
+    comp.add_argument("--candidate", help="run id or git revision (default: latest run)")
+    comp.add_argument("--alpha", type=float, default=ALPHA)
+    comp.add_argument("--min-slowdown", type=float, default=MIN_SLOWDOWN)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        results = benchmark.run_sweep(args.image, args.backends, None, args.sizes,
+                                      args.kernel_sizes, args.warmup, args.repeats)
+        run_id = record(results, args.history)
+        print(f"Recorded run {run_id} in {args.history}")
+        return 0
+
+    records = load(args.history)
+    machine = machine_id()
+    ids = run_ids(records, machine)
+    candidate = resolve_run(records, args.candidate, machine) if args.candidate else (ids[-1] if ids else None)
+    if args.baseline:
+        baseline = resolve_run(records, args.baseline, machine)
+    else:
+        earlier = ids[:ids.index(candidate)] if candidate else []
+        baseline = earlier[-1] if earlier else None
+    if baseline is None or candidate is None:
+        print("Need at least two runs on this machine to compare.")
+        return 2
+
+    comparisons = compare(records, baseline, candidate, args.alpha, args.min_slowdown)
+    print(f"Baseline {baseline}  ->  candidate {candidate}")
+    print(f"{'Backend':<8} {'Filter Type':<24} {'Size':>6} {'k':>3} {'Base':>10} {'New':>10} {'Ratio':>7} {'p':>8}")
+    for c in comparisons:
+        flag = "  REGRESSION" if c.regression else ""
+        print(f"{c.backend:<8} {c.filter:<24} {c.size:>6} {c.kernel_size:>3} {c.baseline_median:>9.4f}s "
+              f"{c.candidate_median:>9.4f}s {c.ratio:>6.2f}x {c.p_value:>8.4f}{flag}")
+    regressions = [c for c in comparisons if c.regression]
+    print(f"{len(regressions)} significant slowdown(s) out of {len(comparisons)} points")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
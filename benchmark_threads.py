@@ -0,0 +1,79 @@
+import csv
+import os
+import pathlib
+import time
+
+import numpy as np
+from PIL import Image
+
+from process_image_cython import (
+    create_gaussian_kernel,
+    apply_filter,
+    apply_sobel,
+    apply_median_filter
+)
+
+# 8K UHD frame
+TARGET_SIZE = (7680, 4320)
+
+
+def thread_counts(max_threads: int) -> list:
+    """1, 2, 4, ... up to max_threads (always included)."""
+    counts = []
+    n = 1
+    while n < max_threads:
+        counts.append(n)
+        n *= 2
+    counts.append(max_threads)
+    return counts
+
+
+def benchmark_threads(input_path: str = "image.jpg", repeats: int = 3) -> list:
+    """Measures throughput of the Cython filters against the number of OpenMP threads"""
+
+    # Bundled image scaled up to 8K
+    img = Image.open(input_path).convert('L').resize(TARGET_SIZE, Image.BILINEAR)
+    image = np.asarray(img)
+    megapixels = image.shape[0] * image.shape[1] / 1e6
+    kernel = create_gaussian_kernel(9, sigma=3)
+
+    filters = [
+        ("Sobel", lambda n: apply_sobel(image, num_threads=n)),
+        ("Gaussian", lambda n: apply_filter(image, kernel, num_threads=n)),
+        ("Median Noise-reduction", lambda n: apply_median_filter(image, 3, num_threads=n))
+    ]
+
+    results = []
+    for filter_name, filter_func in filters:
+        baseline = None
+        for n in thread_counts(os.cpu_count() or 1):
+            filter_func(n)  # warm-up
+            best = float("inf")
+            for _ in range(repeats):
+                start_time = time.perf_counter()
+                filter_func(n)
+                best = min(best, time.perf_counter() - start_time)
+            baseline = baseline or best
+            results.append({
+                'Filter Type': filter_name,
+                'Threads': n,
+                'Processing Time (seconds)': best,
+                'Throughput (MP/s)': megapixels / best,
+                'Speedup': baseline / best
+            })
+            print(f"{filter_name:<25} {n:>4} threads {best:>9.4f}s "
+                  f"{megapixels / best:>9.1f} MP/s {baseline / best:>6.2f}x")
+    return results
+
+
+if __name__ == "__main__":
+    print(f"Scaling image.jpg to {TARGET_SIZE[0]}x{TARGET_SIZE[1]}...")
+    rows = benchmark_threads()
+
+    csv_dir = pathlib.Path("metrics")
+    csv_dir.mkdir(parents=True, exist_ok=True)
+    with open(csv_dir / "thread_scaling.csv", mode='w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    print("Thread scaling results saved to metrics/thread_scaling.csv")
@@ -0,0 +1,95 @@
+"""
+FFT overlap-add convolution and the direct / separable / FFT chooser
+shared by the NumPy and Cython backends.
+
+Direct convolution costs kh*kw multiply-adds per pixel and a separable
+kernel kh+kw, while FFT convolution costs a few dozen operations per
+pixel whatever the kernel size. fft_convolve gives the same zero-padded
+result as scipy.ndimage.convolve(image, kernel, mode='constant') (same
+kernel origin, also for even sizes) up to floating-point rounding.
+Only numpy.fft is used, so the Cython module keeps working without SciPy.
+"""
+
+import numpy as np
+
+METHODS = ("auto", "direct", "separable", "fft")
+
+
+def _fast_length(n: int) -> int:
+    """Smallest 2^a * 3^b * 5^c >= n, a length numpy.fft handles quickly."""
+    best = 1 << max(n - 1, 0).bit_length()
+    power5 = 1
+    while power5 < best:
+        power35 = power5
+        while power35 < best:
+            length = power35
+            while length < n:
+                length *= 2
+            best = min(best, length)
+            power35 *= 3
+        power5 *= 5
+    return best
+
+
+def _block_shape(kernel_shape: tuple, image_shape: tuple) -> tuple:
+    """
+    Tile size of the overlap-add: about 4x the kernel in each direction,
+    so most of each transform is useful output, but at least 128 pixels
+    (fewer, larger transforms) and at most the image.
+    """
+    return tuple(max(min(max(4 * k, 128), n), 1) for k, n in zip(kernel_shape, image_shape))
+
+
+def fft_convolve(image: np.ndarray, kernel: np.ndarray) -> np.ndarray:
+    """
+    Zero-padded 2D convolution by FFT overlap-add, in float64.
+
+    The image is cut into tiles; each tile is convolved with the kernel in
+    the frequency domain and its full (tile + kernel - 1) result is added
+    into the output, so memory stays proportional to the tile size. An
+    H x W x C image has every channel transformed in the same call.
+    """
+    image = np.asarray(image, dtype=np.float64)
+    kernel = np.asarray(kernel, dtype=np.float64)
+    height, width = image.shape[:2]
+    channels = image.shape[2:]
+    kh, kw = kernel.shape
+    if image.size == 0:
+        return np.zeros(image.shape)
+    cy, cx = kh // 2, kw // 2
+    bh, bw = _block_shape(kernel.shape, (height, width))
+    fh, fw = _fast_length(bh + kh - 1), _fast_length(bw + kw - 1)
+    kernel_spectrum = np.fft.rfft2(kernel, (fh, fw))
+    # Broadcast the kernel over the channel axis
+    kernel_spectrum = kernel_spectrum.reshape(kernel_spectrum.shape + (1,) * len(channels))
+
+    # Full convolution, cropped afterwards to the scipy.ndimage origin
+    full = np.zeros((height + kh - 1, width + kw - 1) + channels)
+    for top in range(0, height, bh):
+        for left in range(0, width, bw):
+            tile = image[top:top + bh, left:left + bw]
+            th, tw = tile.shape[:2]
+            spectrum = np.fft.rfft2(tile, (fh, fw), axes=(0, 1))
+            product = np.fft.irfft2(spectrum * kernel_spectrum, (fh, fw), axes=(0, 1))
+            full[top:top + th + kh - 1, left:left + tw + kw - 1] += product[:th + kh - 1, :tw + kw - 1]
+    return full[cy:cy + height, cx:cx + width]
+
+
+def choose_method(image_shape: tuple, kernel_shape: tuple, separable: bool,
+                  fft_min_taps: int, fft_min_separable_taps: int) -> str:
+    """
+    Picks "direct", "separable" or "fft" for a kernel of kernel_shape.
+
+    A direct pass needs kh*kw multiply-adds per pixel and a separable one
+    kh+kw. The two thresholds are the backend's measured crossovers: the
+    number of multiply-adds per pixel from which the FFT is faster. Images
+    smaller than the kernel never amortize the transforms.
+    """
+    kh, kw = kernel_shape
+    if separable:
+        use_fft = kh + kw >= fft_min_separable_taps
+    else:
+        use_fft = kh * kw >= fft_min_taps
+    if use_fft and min(image_shape) >= min(kh, kw):
+        return "fft"
+    return "separable" if separable else "direct"
@@ -0,0 +1,148 @@
+"""
+Checks that the alternative paths of the backends give the outputs they
+promise: edge cases that must not crash, the faster variants against the
+plain NumPy filters, and the buffer reuse of the frame streams.
+
+    python -m pytest -q equivalence_test.py
+"""
+
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("backend_name", ["process_image_numpy", "process_image_cython"])
+def test_median_of_empty_images(backend_name):
+    backend = pytest.importorskip(backend_name)
+    for shape in [(5, 0), (0, 5), (5, 0, 3)]:
+        image = np.zeros(shape, dtype=np.uint8)
+        for method in ("histogram", "sort"):
+            result = backend.apply_median_filter(image, 3, method=method)
+            assert result.shape == shape and result.dtype == np.uint8
+
+
+def test_reduced_decode_of_16_bit_and_palette_images(tmp_path):
+    from PIL import Image
+    import process_image_numpy
+    Image.fromarray(np.arange(256 * 256, dtype=np.uint16).reshape(256, 256)).save(tmp_path / "deep.png")
+    assert process_image_numpy.read_image(tmp_path / "deep.png", max_size=64).shape == (64, 64)
+    Image.open("image.jpg").convert("P").save(tmp_path / "palette.png")
+    assert process_image_numpy.read_image(tmp_path / "palette.png", "RGB", max_size=100).shape == (75, 100, 3)
+
+
+@pytest.mark.parametrize("backend_name", ["process_image_numpy", "process_image_cython"])
+def test_fast_gaussian_within_documented_bound(backend_name):
+    backend = pytest.importorskip(backend_name)
+    import process_image_numpy
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (96, 120), dtype=np.uint8)
+    # Checkerboard-like blocks stress the tails of the kernel
+    image[::7] = 255
+    for sigma in (3.01, 3.05, 4.5, 9.0):
+        radius = int(np.ceil(5 * sigma))
+        exact = process_image_numpy.apply_filter(
+            image.astype(np.float64), process_image_numpy.create_gaussian_kernel(2 * radius + 1, sigma, separable=True))
+        fast = backend.apply_gaussian(image, sigma=sigma, mode="fast").astype(np.float64)
+        # kernels.py: at most 255 * 0.147 / 2 < 19 levels, plus one for truncation
+        assert np.abs(fast - exact).max() <= 20
+
+
+@pytest.mark.parametrize("backend_name", ["process_image_numpy", "process_image_cython"])
+@pytest.mark.parametrize("step", ["sobel", ("sobel", {"magnitude": "max_min"}), ("gaussian", {"size": 9, "sigma": 3})])
+def test_stream_reuses_its_buffers(backend_name, step):
+    import tracemalloc
+    import process_image_numpy
+    from streaming import FrameStream
+    backend = pytest.importorskip(backend_name)
+    frames = np.random.default_rng(0).integers(0, 256, (3, 240, 320), dtype=np.uint8)
+    stream = FrameStream([step], backend)
+    stream.process(frames[0])
+    tracemalloc.start()
+    try:
+        result = stream.process(frames[1])
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    # A single 240 x 320 float32 image is 300 KiB
+    assert peak < 64 * 1024
+    name, params = (step, {}) if isinstance(step, str) else step
+    assert np.array_equal(result, getattr(process_image_numpy, "apply_" + name)(frames[1], **params))
+
+
+CHAIN = ["median", ("gaussian", {"size": 9, "sigma": 3}), "sobel"]
+
+
+def _in_sequence(backend, image, steps):
+    from tiled_processing import FILTERS
+    for name, params in steps:
+        image = FILTERS[name][1](backend, image, **params)
+    return image
+
+
+@pytest.mark.parametrize("backend_name", ["process_image_numpy", "process_image_cython"])
+def test_pipeline_matches_the_filters_in_sequence(backend_name):
+    from pipeline import Pipeline
+    backend = pytest.importorskip(backend_name)
+    image = np.random.default_rng(0).integers(0, 256, (150, 90), dtype=np.uint8)
+    steps = [(step, {}) if isinstance(step, str) else step for step in CHAIN]
+    expected = _in_sequence(backend, image, steps)
+    for strip_rows in (None, 7, 64):
+        assert np.array_equal(Pipeline(CHAIN, backend, strip_rows).run(image), expected)
+    if backend_name == "process_image_numpy":
+        # Other dtypes skip the buffer reuse
+        floats = image.astype(np.float64)
+        assert np.array_equal(Pipeline(CHAIN, backend, 7).run(floats), _in_sequence(backend, floats, steps))
+
+
+@pytest.mark.parametrize("filter_name, params", [("sobel", {}), ("gaussian", {"size": 7, "sigma": 2}),
+                                                 ("median", {"size": 5})])
+def test_tiled_matches_the_whole_image(tmp_path, filter_name, params):
+    import process_image_numpy
+    from tiled_processing import FILTERS, filter_tiled
+    image = np.random.default_rng(0).integers(0, 256, (70, 90), dtype=np.uint8)
+    np.save(tmp_path / "source.npy", image)
+    filter_tiled(tmp_path / "source.npy", tmp_path / "tiled.npy", filter_name, tile_rows=17, tile_cols=23, **params)
+    expected = FILTERS[filter_name][1](process_image_numpy, image, **params)
+    assert np.array_equal(np.load(tmp_path / "tiled.npy"), expected)
+
+
+@pytest.mark.parametrize("dtype", [np.int16, np.uint16, np.int32, np.int64])
+def test_cython_accepts_other_integer_types(dtype):
+    cython = pytest.importorskip("process_image_cython")
+    image = np.random.default_rng(0).integers(0, 256, (40, 50), dtype=np.uint8)
+    for apply in (cython.apply_sobel, lambda image: cython.apply_median_filter(image, 3),
+                  lambda image: cython.apply_gaussian(image, 9, 3)):
+        assert np.array_equal(apply(image.astype(dtype)), apply(image))
+
+
+@pytest.mark.parametrize("backend_name", ["process_image_numpy", "process_image_cython"])
+def test_histogram_median_matches_sort(backend_name):
+    import process_image_numpy
+    backend = pytest.importorskip(backend_name)
+    rng = np.random.default_rng(0)
+    for shape in [(37, 53), (20, 31, 3), (4, 9)]:
+        image = rng.integers(0, 256, shape, dtype=np.uint8)
+        for size in (1, 3, 7, 15):
+            expected = process_image_numpy.apply_median_filter(image, size, method="sort")
+            for method in ("histogram", "sort"):
+                assert np.array_equal(backend.apply_median_filter(image, size, method=method), expected)
+
+
+def test_backends_agree_on_the_median():
+    import backends
+    rng = np.random.default_rng(0)
+    names = backends.available()
+    for shape in [(12, 14), (3, 2), (9, 7, 3), (5, 0)]:
+        image = rng.integers(0, 256, shape, dtype=np.uint8)
+        for size in (3, 5):
+            expected = backends.apply_median(image, size, backend="numpy")
+            for name in names:
+                assert np.array_equal(backends.apply_median(image, size, backend=name), expected)
+
+
+@pytest.mark.parametrize("backend_name", ["process_image_numpy", "process_image_cython"])
+def test_read_image_is_read_only_unless_asked(backend_name):
+    backend = pytest.importorskip(backend_name)
+    assert not backend.read_image("image.jpg").flags.writeable
+    image = backend.read_image("image.jpg", writable=True)
+    image[0, 0] = 0
+    assert np.array_equal(image[1:], backend.read_image("image.jpg")[1:])
@@ -0,0 +1,237 @@
+"""
+Opt-in per-stage profiling of the filter backends.
+
+The backends mark their stages (decode, convert, pad, compute,
+clip/cast, encode) and each public call. While no profiler is active
+these marks cost one global lookup; inside a Profiler every stage is
+recorded with its duration and, when memory=True, the tracemalloc peak
+above the level at entry and the bytes still held at exit.
+
+    with Profiler() as profiler:
+        image = process_image_numpy.read_image("image.jpg")
+        process_image_numpy.save_image(process_image_numpy.apply_sobel(image), "edges.png")
+    print(profiler.report())
+    profiler.to_chrome_trace("trace.json")   # chrome://tracing or https://ui.perfetto.dev
+    profiler.to_jsonl("stages.jsonl")        # one JSON object per stage
+
+    python instrumentation.py image.jpg --backend cython --filter gaussian --trace trace.json
+
+tracemalloc sees NumPy arrays and Python objects but not the C scratch
+buffers of the Cython backend, and its peak is process-wide, so memory
+figures are exact only for single-threaded callers.
+"""
+
+import argparse
+import contextlib
+import functools
+import json
+import os
+import pathlib
+import threading
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+
+STAGES = ("decode", "convert", "pad", "compute", "clip/cast", "encode")
+
+# Profiler receiving the events, None while profiling is off
+_active = None
+_local = threading.local()
+_NULL = contextlib.nullcontext()
+
+
+@dataclass
+class StageEvent:
+    """One timed stage or call."""
+    name: str
+    category: str  # "stage" or the backend of a whole call
+    start_ns: int  # since the profiler started
+    duration_ns: int
+    thread: int
+    depth: int  # nesting level within its thread
+    peak_bytes: int = None  # tracemalloc peak above the level at entry
+    net_bytes: int = None  # traced bytes still held at exit
+
+
+class _Span:
+    """Context manager timing one stage into a profiler."""
+
+    __slots__ = ("profiler", "name", "category", "start", "depth", "memory_start", "peak")
+
+    def __init__(self, profiler, name: str, category: str):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+
+    def __enter__(self):
+        stack = _stack()
+        if self.profiler.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # The enclosing span keeps the peak reached so far, this one starts afresh
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            self.memory_start = self.peak = current
+        self.depth = len(stack)
+        stack.append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter_ns()
+        stack = _stack()
+        stack.pop()
+        peak_bytes = net_bytes = None
+        if self.profiler.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            self.peak = max(self.peak, peak)
+            peak_bytes, net_bytes = self.peak - self.memory_start, current - self.memory_start
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, self.peak)
+        self.profiler.record(StageEvent(self.name, self.category, self.start - self.profiler.origin_ns,
+                                        end - self.start, threading.get_ident(), self.depth,
+                                        peak_bytes, net_bytes))
+        return False
+
+
+def _stack() -> list:
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def stage(name: str, category: str = "stage"):
+    """Context manager marking a stage; does nothing unless a profiler is active."""
+    profiler = _active
+    if profiler is None:
+        return _NULL
+    return _Span(profiler, name, category)
+
+
+def traced(backend: str):
+    """Decorator recording every call of a backend function as one event of category backend."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = _active
+            if profiler is None:
+                return func(*args, **kwargs)
+            with _Span(profiler, func.__name__, backend):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class Profiler:
+    """Collects StageEvents while active (use as a context manager, or start/stop)."""
+
+    def __init__(self, memory: bool = True):
+        self.memory = memory
+        self.events = []
+        self.lock = threading.Lock()
+        self.origin_ns = time.perf_counter_ns()
+        self._owns_tracemalloc = False
+
+    def start(self) -> "Profiler":
+        global _active
+        if _active is not None and _active is not self:
+            raise RuntimeError("another profiler is already active")
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracemalloc = True
+        _active = self
+        return self
+
+    def stop(self) -> "Profiler":
+        global _active
+        if _active is self:
+            _active = None
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+            self._owns_tracemalloc = False
+        return self
+
+    def __enter__(self) -> "Profiler":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+    def record(self, event: StageEvent) -> None:
+        with self.lock:
+            self.events.append(event)
+
+    def summary(self) -> dict:
+        """(category, name) -> calls, total seconds and largest peak_bytes, in first-seen order."""
+        totals = {}
+        for event in self.events:
+            entry = totals.setdefault((event.category, event.name), {"calls": 0, "seconds": 0.0, "peak_bytes": None})
+            entry["calls"] += 1
+            entry["seconds"] += event.duration_ns / 1e9
+            if event.peak_bytes is not None:
+                entry["peak_bytes"] = max(entry["peak_bytes"] or 0, event.peak_bytes)
+        return totals
+
+    def report(self) -> str:
+        """Plain-text table of the summary."""
+        lines = [f"{'category':<10} {'stage':<22} {'calls':>6} {'total ms':>10} {'peak MiB':>9}"]
+        for (category, name), entry in self.summary().items():
+            peak = "" if entry["peak_bytes"] is None else f"{entry['peak_bytes'] / 2**20:.2f}"
+            lines.append(f"{category:<10} {name:<22} {entry['calls']:>6} {entry['seconds'] * 1e3:>10.2f} {peak:>9}")
+        return "\n".join(lines)
+
+    def to_chrome_trace(self, path=None) -> dict:
+        """Chrome trace-event JSON (complete "X" events, microseconds), written to path if given."""
+        pid = os.getpid()
+        trace = {"traceEvents": [
+            {"name": event.name, "cat": event.category, "ph": "X", "pid": pid, "tid": event.thread,
+             "ts": event.start_ns / 1e3, "dur": event.duration_ns / 1e3,
+             "args": {"peak_bytes": event.peak_bytes, "net_bytes": event.net_bytes}}
+            for event in self.events
+        ], "displayTimeUnit": "ms"}
+        if path is not None:
+            pathlib.Path(path).write_text(json.dumps(trace))
+        return trace
+
+    def to_jsonl(self, path) -> None:
+        """Structured log: one JSON object per event."""
+        with open(path, "w") as file:
+            for event in self.events:
+                file.write(json.dumps(asdict(event)) + "\n")
+
+
+def main() -> None:
+    import importlib
+    parser = argparse.ArgumentParser(description="Profile read -> filter -> save with one backend.")
+    parser.add_argument("image")
+    parser.add_argument("--backend", choices=["python", "numpy", "cython"], default="numpy")
+    parser.add_argument("--filter", choices=["sobel", "gaussian", "median"], default="sobel")
+    parser.add_argument("--output", default="profiled.png")
+    parser.add_argument("--no-memory", action="store_true", help="time only, without tracemalloc")
+    parser.add_argument("--trace", help="write a Chrome trace-event JSON here")
+    parser.add_argument("--log", help="write one JSON line per stage here")
+    args = parser.parse_args()
+
+    module = importlib.import_module(f"process_image_{args.backend}")
+    with Profiler(memory=not args.no_memory) as profiler:
+        image = module.read_image(args.image)
+        if args.filter == "sobel":
+            result = module.apply_sobel(image)
+        elif args.filter == "gaussian":
+            kernel = module.create_gaussian_kernel(9, 3, separable=True)
+            result = module.apply_gaussian(image, kernel) if args.backend == "python" else module.apply_filter(image, kernel)
+        else:
+            result = module.apply_median_filter(image, (3, 3) if args.backend == "python" else 3)
+        module.save_image(result, args.output)
+    print(profiler.report())
+    if args.trace:
+        profiler.to_chrome_trace(args.trace)
+    if args.log:
+        profiler.to_jsonl(args.log)
+
+
+if __name__ == "__main__":
+    # Run through the imported module: the backends report to its profiler, not to __main__'s
+    import instrumentation
+    instrumentation.main()
@@ -0,0 +1,136 @@
+"""
+Memoized Gaussian kernel factory and Sobel magnitude table shared by
+every backend.
+
+Kernels are computed once per (size, sigma, dtype, separable) key and
+kept in a bounded LRU cache, so batch jobs that filter thousands of
+images with the same parameters build each kernel a single time. The
+coefficients are exp(-d^2 / (2 sigma^2)) over integer offsets from the
+centre, normalized to sum to 1; the 2D kernel is the outer product of the
+normalized 1D factor. Every backend therefore sees identical values.
+
+Cached kernels are shared, so they are immutable: tuples for the
+pure-Python backend (dtype=None) and read-only NumPy arrays otherwise.
+
+sqrt_table maps a squared Sobel gradient gx^2 + gy^2 to its exact
+truncated magnitude, so the integer Sobel paths never take a square root.
+
+box_radii gives the box filters whose cascade approximates a Gaussian
+(the "fast" Gaussian mode of the array backends): three boxes of widths
+w_l or w_l + 2, picked so the variances add up to about sigma^2 (Kovesi,
+"Fast almost-Gaussian filtering", 2010). Scanning sigma over [3, 40) in
+steps of 0.01, the 2D cascade kernel is within an L1 distance of 0.147 of
+the ideal Gaussian (worst at sigma = 3.01, median 0.079). Both
+kernels sum to 1, so a filtered uint8 pixel differs from the ideal
+Gaussian result by at most 255 * 0.147 / 2 < 19 grey levels, plus one for
+truncation. The effective sigma lies between 5.7% below and 5.1% above
+sigma, depending on how the widths round. On photographs (image.jpg) the
+largest difference is under 5 levels and the mean under one. Below
+FAST_GAUSSIAN_MIN_SIGMA the boxes are too narrow to be bell-shaped, so
+the fast mode uses the exact kernel.
+"""
+
+import math
+from functools import lru_cache
+
+# Distinct kernels kept in each cache
+KERNEL_CACHE_SIZE = 64
+
+# Sobel magnitude modes: exact floor(sqrt(gx^2 + gy^2)), |gx| + |gy|, max + min / 2
+SOBEL_MAGNITUDES = ("exact", "l1", "max_min")
+# Squared gradients from here on have a magnitude that clips to 255
+MAX_SQUARED_MAGNITUDE = 255 * 255
+
+# Gaussian modes: exact kernel, or a cascade of box filters
+GAUSSIAN_MODES = ("exact", "fast")
+# Box filters in the fast Gaussian cascade
+BOX_PASSES = 3
+# Sigma below which the fast Gaussian falls back to the exact kernel
+FAST_GAUSSIAN_MIN_SIGMA = 3.0
+
+
+@lru_cache(maxsize=KERNEL_CACHE_SIZE)
+def _coefficients(size: int, sigma: float, separable: bool) -> tuple:
+    center = size // 2
+    factor = [math.exp(-((i - center) ** 2) / (2 * sigma**2)) for i in range(size)]
+    total = math.fsum(factor)
+    factor = tuple(value / total for value in factor)
+    if separable:
+        return factor
+    return tuple(tuple(a * b for b in factor) for a in factor)
+
+
+@lru_cache(maxsize=KERNEL_CACHE_SIZE)
+def _array(size: int, sigma: float, dtype: str, separable: bool):
+    import numpy as np
+    kernel = np.array(_coefficients(size, sigma, separable), dtype=dtype)
+    kernel.setflags(write=False)
+    return kernel
+
+
+def gaussian_kernel(size: int, sigma: float = 1, separable: bool = False, dtype=None):
+    """
+    Returns the normalized Gaussian kernel of size x size (or its 1D factor
+    with separable=True). dtype=None gives nested tuples for the pure-Python
+    backend; a NumPy dtype gives a read-only array of that type.
+    """
+    size, sigma = int(size), float(sigma)
+    if size < 1:
+        raise ValueError(f"kernel size must be positive, got {size}")
+    if sigma <= 0:
+        raise ValueError(f"sigma must be positive, got {sigma}")
+    if dtype is None:
+        return _coefficients(size, sigma, bool(separable))
+    import numpy as np
+    return _array(size, sigma, np.dtype(dtype).str, bool(separable))
+
+
+@lru_cache(maxsize=1)
+def sqrt_table() -> bytes:
+    """floor(sqrt(s)) for s in 0..MAX_SQUARED_MAGNITUDE, one byte per entry."""
+    return bytes(math.isqrt(s) for s in range(MAX_SQUARED_MAGNITUDE + 1))
+
+
+def sobel_magnitude_mode(magnitude: str) -> int:
+    """Index of a Sobel magnitude mode in SOBEL_MAGNITUDES, checking its name."""
+    if magnitude not in SOBEL_MAGNITUDES:
+        raise ValueError(f"unknown magnitude '{magnitude}', expected one of {SOBEL_MAGNITUDES}")
+    return SOBEL_MAGNITUDES.index(magnitude)
+
+
+@lru_cache(maxsize=KERNEL_CACHE_SIZE)
+def box_radii(sigma: float, passes: int = BOX_PASSES) -> tuple:
+    """Radii of the `passes` box filters whose cascade best matches a Gaussian of this sigma."""
+    if sigma <= 0:
+        raise ValueError(f"sigma must be positive, got {sigma}")
+    # Ideal width of equal boxes, rounded down to odd; the largest `passes - low` boxes are 2 wider
+    width = int(math.sqrt(12 * sigma**2 / passes + 1))
+    if width % 2 == 0:
+        width -= 1
+    low = round((12 * sigma**2 - passes * width**2 - 4 * passes * width - 3 * passes) / (-4 * width - 4))
+    low = min(max(low, 0), passes)
+    return tuple((width if k < low else width + 2) // 2 for k in range(passes))
+
+
+def gaussian_mode(mode: str) -> str:
+    """Checks the name of a Gaussian mode (see GAUSSIAN_MODES)."""
+    if mode not in GAUSSIAN_MODES:
+        raise ValueError(f"unknown Gaussian mode '{mode}', expected one of {GAUSSIAN_MODES}")
+    return mode
+
+
+def gaussian_halo(size: int = 9, sigma: float = 3, mode: str = "exact") -> int:
+    """Pixels on each side a Gaussian of these parameters reads."""
+    if gaussian_mode(mode) == "fast" and sigma >= FAST_GAUSSIAN_MIN_SIGMA:
+        return sum(box_radii(float(sigma)))
+    return int(size) // 2
+
+
+def cache_info() -> dict:
+    """Hit/miss statistics of the tuple and array caches."""
+    return {"coefficients": _coefficients.cache_info(), "arrays": _array.cache_info()}
+
+
+def clear_cache() -> None:
+    _coefficients.cache_clear()
+    _array.cache_clear()
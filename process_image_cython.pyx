@@ -1,52 +1,774 @@
-from libc.math cimport exp
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+from libc.math cimport sqrt
+from libc.stdlib cimport malloc, free
+from libc.string cimport memset
+from cython.parallel cimport prange, threadid
+import os
 import numpy as np
 cimport numpy as cnp
 from PIL import Image
-from scipy.ndimage import convolve, median_filter
+
+from image_io import open_image
+from instrumentation import stage, traced
+from kernels import FAST_GAUSSIAN_MIN_SIGMA, box_radii, gaussian_kernel, gaussian_mode, sobel_magnitude_mode, sqrt_table
 
 SOBEL_X = np.array([[-1, 0, 1], [-2, 0, 2], [-1, 0, 1]], dtype=np.float64)
 SOBEL_Y = np.array([[-1, -2, -1], [0, 0, 0], [1, 2, 1]], dtype=np.float64)
 
-def read_image(path: str) -> np.ndarray:
-    """Reads a grayscale image and returns it as a 2D NumPy array."""
-    img = Image.open(path).convert('L')
-    return np.array(img, dtype=np.float64)
-
-def save_image(image: np.ndarray, path: str) -> None:
-    """Saves a NumPy array as a grayscale image."""
-    img = Image.fromarray(image.astype(np.uint8))
-    img.save(path)
-
-def create_gaussian_kernel(size: int, sigma: float = 1) -> np.ndarray:
-    """Creates a Gaussian kernel."""
-    cdef int i, j
-    cdef double[:, :] kernel = np.zeros((size, size), dtype=np.float64)
-    cdef int center = size // 2
-    cdef double sum_val = 0.0
-    cdef double x, y
-    
-    for i in range(size):
-        for j in range(size):
-            x = i - center
-            y = j - center
-            kernel[i, j] = exp(-(x**2 + y**2) / (2 * sigma**2))
-            sum_val += kernel[i, j]
-    
-    return np.asarray(kernel) / sum_val  # Convert to NumPy array before division
-
-def apply_filter(image: np.ndarray, kernel: np.ndarray) -> np.ndarray:
-    """Applies a convolution filter to an image using Cython."""
-    cdef double[:, :] img_view = image.astype(np.float64)
-    cdef double[:, :] kernel_view = kernel.astype(np.float64)
-    return np.clip(convolve(img_view, kernel_view, mode='constant', cval=0.0), 0, 255).astype(np.uint8)
-
-def apply_sobel(image: np.ndarray) -> np.ndarray:
-    """Applies the Sobel filter to detect edges."""
-    cdef double[:, :] img_view = image.astype(np.float64)
-    grad_x = convolve(img_view, SOBEL_X, mode='constant', cval=0.0)
-    grad_y = convolve(img_view, SOBEL_Y, mode='constant', cval=0.0)
-    return np.clip(np.sqrt(grad_x**2 + grad_y**2), 0, 255).astype(np.uint8)
-
-def apply_median_filter(image: np.ndarray, size: int) -> np.ndarray:
-    """Applies a median filter to an image."""
-    return median_filter(image, size=size).astype(np.uint8)
\ No newline at end of file
+# Histogram median: 256 fine bins grouped into 16 coarse bins, counts kept in 16 bits
+cdef enum:
+    FINE_BINS = 256
+    COARSE_BINS = 16
+    MAX_HISTOGRAM_SIZE = 255
+# Sobel magnitude modes, in the order of kernels.SOBEL_MAGNITUDES
+cdef enum:
+    MAGNITUDE_EXACT = 0
+    MAGNITUDE_L1 = 1
+    MAGNITUDE_MAX_MIN = 2
+    # kernels.MAX_SQUARED_MAGNITUDE, the last entry of the square-root table
+    MAX_SQUARED_MAGNITUDE = 65025
+# Window size from which the histogram median beats sorting each window
+HISTOGRAM_MEDIAN_MIN_SIZE = 3
+# Multiply-adds per pixel (single thread) from which FFT convolution beats the native passes
+FFT_MIN_TAPS = 16
+FFT_MIN_SEPARABLE_TAPS = 40
+
+# Pixel types the filters accept without converting the input first
+ctypedef fused pixel_t:
+    unsigned char
+    float
+    double
+
+
+cdef inline unsigned char _clip_u8(double value) noexcept nogil:
+    """Clamps to 0-255 and truncates, like np.clip(...).astype(np.uint8)."""
+    if value <= 0.0:
+        return 0
+    if value >= 255.0:
+        return 255
+    return <unsigned char>value
+
+
+cdef inline Py_ssize_t _reflect(Py_ssize_t i, Py_ssize_t n) noexcept nogil:
+    """Maps an index outside [0, n) like scipy's mode='reflect' (d c b a | a b c d)."""
+    i = i % (2 * n)
+    if i < 0:
+        i += 2 * n
+    if i >= n:
+        i = 2 * n - 1 - i
+    return i
+
+
+cdef double _select(double* values, Py_ssize_t n, Py_ssize_t k) noexcept nogil:
+    """Returns the k-th smallest value of values[:n] (quickselect, reorders in place)."""
+    cdef Py_ssize_t lo = 0, hi = n - 1, i, j
+    cdef double pivot, tmp
+    while lo < hi:
+        pivot = values[(lo + hi) // 2]
+        i = lo
+        j = hi
+        while i <= j:
+            while values[i] < pivot:
+                i += 1
+            while values[j] > pivot:
+                j -= 1
+            if i <= j:
+                tmp = values[i]
+                values[i] = values[j]
+                values[j] = tmp
+                i += 1
+                j -= 1
+        if k <= j:
+            hi = j
+        elif k >= i:
+            lo = i
+        else:
+            break
+    return values[k]
+
+
+cdef void _convolve_row(const pixel_t[:, :] img, Py_ssize_t channels, const double[:, ::1] kernel,
+                       unsigned char[:, ::1] out, Py_ssize_t i) noexcept nogil:
+    """Zero-padded 2D convolution of row i, with the same kernel origin as scipy.ndimage.convolve."""
+    cdef Py_ssize_t height = img.shape[0], width = img.shape[1] // channels
+    cdef Py_ssize_t kh = kernel.shape[0], kw = kernel.shape[1]
+    cdef Py_ssize_t cy = kh // 2, cx = kw // 2
+    cdef Py_ssize_t j, ch, m, n, y, x, m_lo, m_hi, n_lo, n_hi
+    cdef double acc
+
+    # Only the kernel rows that land inside the image contribute (zero padding)
+    m_lo = i + cy - (height - 1) if i + cy - (height - 1) > 0 else 0
+    m_hi = i + cy if i + cy < kh - 1 else kh - 1
+    for j in range(width):
+        n_lo = j + cx - (width - 1) if j + cx - (width - 1) > 0 else 0
+        n_hi = j + cx if j + cx < kw - 1 else kw - 1
+        for ch in range(channels):
+            acc = 0.0
+            for m in range(m_lo, m_hi + 1):
+                y = i + cy - m
+                x = (j + cx) * channels + ch
+                for n in range(n_lo, n_hi + 1):
+                    acc += kernel[m, n] * img[y, x - n * channels]
+            out[i, j * channels + ch] = _clip_u8(acc)
+
+
+cdef void _convolve_row_1d(const pixel_t[:, :] img, Py_ssize_t channels, const double[::1] factor,
+                          double[:, ::1] tmp, Py_ssize_t i) noexcept nogil:
+    """Horizontal zero-padded 1D pass of row i, kept in full precision."""
+    cdef Py_ssize_t width = img.shape[1] // channels
+    cdef Py_ssize_t k = factor.shape[0], c = factor.shape[0] // 2
+    cdef Py_ssize_t j, ch, n, x, n_lo, n_hi
+    cdef double acc
+
+    for j in range(width):
+        n_lo = j + c - (width - 1) if j + c - (width - 1) > 0 else 0
+        n_hi = j + c if j + c < k - 1 else k - 1
+        for ch in range(channels):
+            x = (j + c) * channels + ch
+            acc = 0.0
+            for n in range(n_lo, n_hi + 1):
+                acc += factor[n] * img[i, x - n * channels]
+            tmp[i, j * channels + ch] = acc
+
+
+cdef void _convolve_col_1d(double[:, ::1] tmp, const double[::1] factor, unsigned char[:, ::1] out,
+                          Py_ssize_t i) noexcept nogil:
+    """Vertical zero-padded 1D pass producing output row i (channels need no special care)."""
+    cdef Py_ssize_t height = tmp.shape[0], row_len = tmp.shape[1]
+    cdef Py_ssize_t k = factor.shape[0], c = factor.shape[0] // 2
+    cdef Py_ssize_t j, m, m_lo, m_hi
+    cdef double acc
+
+    m_lo = i + c - (height - 1) if i + c - (height - 1) > 0 else 0
+    m_hi = i + c if i + c < k - 1 else k - 1
+    for j in range(row_len):
+        acc = 0.0
+        for m in range(m_lo, m_hi + 1):
+            acc += factor[m] * tmp[i + c - m, j]
+        out[i, j] = _clip_u8(acc)
+
+
+cdef void _box_line(const double* src, double* dst, Py_ssize_t length, Py_ssize_t channels,
+                    Py_ssize_t r) noexcept nogil:
+    """Zero-padded box mean of one line of interleaved samples, a running sum per channel."""
+    cdef Py_ssize_t ch, j, x
+    cdef double acc, scale = 1.0 / (2 * r + 1)
+    for ch in range(channels):
+        acc = 0.0
+        for x in range(r + 1 if r < length else length):
+            acc += src[x * channels + ch]
+        for j in range(length):
+            dst[j * channels + ch] = acc * scale
+            if j + r + 1 < length:
+                acc += src[(j + r + 1) * channels + ch]
+            if j >= r:
+                acc -= src[(j - r) * channels + ch]
+
+
+cdef void _box_row(const pixel_t[:, :] img, Py_ssize_t channels, const Py_ssize_t[::1] radii,
+                   Py_ssize_t margin, double* a, double* b, double[:, ::1] tmp, Py_ssize_t i) noexcept nogil:
+    """
+    Horizontal box passes of row i, run on the row zero-padded by margin
+    pixels (a and b hold (width + 2 margin) * channels samples each); the
+    cropped result goes to row i + margin of tmp.
+    """
+    cdef Py_ssize_t row_len = img.shape[1], length = row_len // channels + 2 * margin
+    cdef Py_ssize_t offset = margin * channels, j, k
+    cdef double* swap
+    memset(a, 0, length * channels * sizeof(double))
+    for j in range(row_len):
+        a[offset + j] = img[i, j]
+    for k in range(radii.shape[0]):
+        _box_line(a, b, length, channels, radii[k])
+        swap = a
+        a = b
+        b = swap
+    for j in range(row_len):
+        tmp[i + margin, j] = a[offset + j]
+
+
+cdef void _box_columns(const double[:, ::1] src, Py_ssize_t r, Py_ssize_t row_start, Py_ssize_t row_stop,
+                       double* sums, double[:, ::1] dst, unsigned char[:, ::1] out, Py_ssize_t crop,
+                       bint last) noexcept nogil:
+    """
+    Vertical box mean of rows [row_start, row_stop), one running column sum
+    sliding down the strip. The last pass writes row i - crop of out.
+    """
+    cdef Py_ssize_t height = src.shape[0], row_len = src.shape[1]
+    cdef Py_ssize_t i, j, y
+    cdef double scale = 1.0 / (2 * r + 1)
+    if row_start >= row_stop:
+        return
+    memset(sums, 0, row_len * sizeof(double))
+    for y in range(row_start - r if row_start > r else 0, row_start + r + 1 if row_start + r < height else height):
+        for j in range(row_len):
+            sums[j] += src[y, j]
+    for i in range(row_start, row_stop):
+        if last:
+            for j in range(row_len):
+                out[i - crop, j] = _clip_u8(sums[j] * scale)
+        else:
+            for j in range(row_len):
+                dst[i, j] = sums[j] * scale
+        if i + r + 1 < height:
+            for j in range(row_len):
+                sums[j] += src[i + r + 1, j]
+        if i >= r:
+            for j in range(row_len):
+                sums[j] -= src[i - r, j]
+
+
+cdef inline double _at(const pixel_t[:, :] img, Py_ssize_t channels, Py_ssize_t y, Py_ssize_t x,
+                       Py_ssize_t ch) noexcept nogil:
+    """Sample ch of pixel (y, x) with zero padding outside the image."""
+    if y < 0 or x < 0 or y >= img.shape[0] or x >= img.shape[1] // channels:
+        return 0.0
+    return img[y, x * channels + ch]
+
+
+cdef inline unsigned char _magnitude(double gx, double gy, int mode) noexcept nogil:
+    """Gradient magnitude in the given mode, clipped and truncated to uint8."""
+    cdef double ax = gx if gx >= 0 else -gx
+    cdef double ay = gy if gy >= 0 else -gy
+    if mode == MAGNITUDE_L1:
+        return _clip_u8(ax + ay)
+    if mode == MAGNITUDE_MAX_MIN:
+        return _clip_u8(ax + ay / 2 if ax >= ay else ay + ax / 2)
+    return _clip_u8(sqrt(gx * gx + gy * gy))
+
+
+cdef inline unsigned char _sobel_border(const pixel_t[:, :] img, Py_ssize_t channels, Py_ssize_t i,
+                                        Py_ssize_t j, Py_ssize_t ch, int mode) noexcept nogil:
+    cdef double gx, gy
+    gx = (_at(img, channels, i - 1, j + 1, ch) + 2 * _at(img, channels, i, j + 1, ch)
+          + _at(img, channels, i + 1, j + 1, ch) - _at(img, channels, i - 1, j - 1, ch)
+          - 2 * _at(img, channels, i, j - 1, ch) - _at(img, channels, i + 1, j - 1, ch))
+    gy = (_at(img, channels, i + 1, j - 1, ch) + 2 * _at(img, channels, i + 1, j, ch)
+          + _at(img, channels, i + 1, j + 1, ch) - _at(img, channels, i - 1, j - 1, ch)
+          - 2 * _at(img, channels, i - 1, j, ch) - _at(img, channels, i - 1, j + 1, ch))
+    return _magnitude(gx, gy, mode)
+
+
+cdef void _sobel_row(const pixel_t[:, :] img, Py_ssize_t channels, unsigned char[:, ::1] out,
+                     Py_ssize_t i, int mode) noexcept nogil:
+    """Sobel gradient magnitude of row i with zero padding, in floating point."""
+    cdef Py_ssize_t height = img.shape[0], row_len = img.shape[1], width = img.shape[1] // channels
+    cdef Py_ssize_t j, ch, x, c = channels
+    cdef double gx, gy
+
+    if i == 0 or i == height - 1:
+        for j in range(width):
+            for ch in range(channels):
+                out[i, j * channels + ch] = _sobel_border(img, channels, i, j, ch, mode)
+        return
+    for ch in range(channels):
+        out[i, ch] = _sobel_border(img, channels, i, 0, ch, mode)
+    # Interior samples: the horizontal neighbours of a channel are `channels` apart
+    for x in range(c, row_len - c):
+        gx = (<double>img[i - 1, x + c] + 2 * <double>img[i, x + c] + <double>img[i + 1, x + c]
+              - <double>img[i - 1, x - c] - 2 * <double>img[i, x - c] - <double>img[i + 1, x - c])
+        gy = (<double>img[i + 1, x - c] + 2 * <double>img[i + 1, x] + <double>img[i + 1, x + c]
+              - <double>img[i - 1, x - c] - 2 * <double>img[i - 1, x] - <double>img[i - 1, x + c])
+        out[i, x] = _magnitude(gx, gy, mode)
+    if width > 1:
+        for ch in range(channels):
+            out[i, row_len - c + ch] = _sobel_border(img, channels, i, width - 1, ch, mode)
+
+
+cdef void _sobel_row_u8(const unsigned char[:, :] img, Py_ssize_t channels, int* smooth, int* diff,
+                        const unsigned char* table, unsigned char[:, ::1] out, Py_ssize_t i,
+                        int mode) noexcept nogil:
+    """
+    Integer Sobel magnitude of row i in one pass over its three source rows.
+    The kernels factor as [1,2,1] x [-1,0,1]: the vertical [1,2,1] and
+    [-1,0,1] sums of every column are formed once, then gx and gy are
+    short horizontal differences/sums of them, `channels` entries apart.
+    smooth and diff hold row_len + 2 * channels entries whose zero ends
+    give the zero padding.
+    """
+    cdef Py_ssize_t height = img.shape[0], row_len = img.shape[1], c = channels
+    cdef Py_ssize_t x
+    cdef int up, down, gx, gy, ax, ay, lo, value
+
+    for x in range(c):
+        smooth[x] = smooth[row_len + c + x] = 0
+        diff[x] = diff[row_len + c + x] = 0
+    for x in range(row_len):
+        up = img[i - 1, x] if i > 0 else 0
+        down = img[i + 1, x] if i + 1 < height else 0
+        smooth[x + c] = up + 2 * img[i, x] + down
+        diff[x + c] = down - up
+    for x in range(row_len):
+        gx = smooth[x + 2 * c] - smooth[x]
+        gy = diff[x] + 2 * diff[x + c] + diff[x + 2 * c]
+        ax = gx if gx >= 0 else -gx
+        ay = gy if gy >= 0 else -gy
+        if mode == MAGNITUDE_EXACT:
+            value = ax * ax + ay * ay
+            out[i, x] = table[value] if value <= MAX_SQUARED_MAGNITUDE else 255
+            continue
+        value = ax + ay
+        if mode == MAGNITUDE_MAX_MIN:
+            # max + min / 2 == |gx| + |gy| - min + min / 2
+            lo = ax if ax < ay else ay
+            value = value - lo + (lo >> 1)
+        out[i, x] = value if value < 255 else 255
+
+
+cdef void _median_row(const pixel_t[:, :] img, Py_ssize_t channels, Py_ssize_t size, double* window,
+                      unsigned char[:, ::1] out, Py_ssize_t i) noexcept nogil:
+    """Median of row i over a size x size window with scipy's default 'reflect' borders."""
+    cdef Py_ssize_t height = img.shape[0], width = img.shape[1] // channels
+    cdef Py_ssize_t r = size // 2, rank = (size * size) // 2
+    cdef Py_ssize_t j, ch, m, n, y, count
+
+    for j in range(width):
+        for ch in range(channels):
+            count = 0
+            for m in range(size):
+                y = _reflect(i + m - r, height)
+                for n in range(size):
+                    window[count] = img[y, _reflect(j + n - r, width) * channels + ch]
+                    count += 1
+            out[i, j * channels + ch] = _clip_u8(_select(window, count, rank))
+
+
+cdef inline void _column_update(const unsigned char[:, :] img, Py_ssize_t channels, Py_ssize_t y,
+                                Py_ssize_t r, unsigned short* fine, unsigned short* coarse,
+                                int delta) noexcept nogil:
+    """
+    Adds (delta=1) or removes (delta=-1) image row y to every padded column
+    histogram. Column p of channel ch owns histogram ch * (width + 2r) + p,
+    so each channel's histograms are contiguous.
+    """
+    cdef Py_ssize_t width = img.shape[1] // channels, padded_width = width + 2 * r, p, ch, h
+    cdef unsigned char value
+    for ch in range(channels):
+        for p in range(padded_width):
+            value = img[y, _reflect(p - r, width) * channels + ch]
+            h = ch * padded_width + p
+            fine[h * FINE_BINS + value] += delta
+            coarse[h * COARSE_BINS + (value >> 4)] += delta
+
+
+cdef void _median_histogram_rows(const unsigned char[:, :] img, Py_ssize_t channels, Py_ssize_t size,
+                                 Py_ssize_t row_start, Py_ssize_t row_stop,
+                                 unsigned short* col_fine, unsigned short* col_coarse,
+                                 unsigned char[:, ::1] out) noexcept nogil:
+    """
+    Perreault-Hebert median of rows [row_start, row_stop): one histogram per
+    column and channel slides down the image and the window histogram slides
+    along the row, so the cost per pixel does not depend on the window size.
+    """
+    cdef Py_ssize_t height = img.shape[0], width = img.shape[1] // channels
+    cdef Py_ssize_t r = size // 2, rank = (size * size) // 2
+    cdef Py_ssize_t padded_width = width + 2 * r, columns = padded_width * channels
+    cdef Py_ssize_t i, j, ch, p, b, c, count, h, first
+    cdef unsigned short fine[FINE_BINS]
+    cdef unsigned short coarse[COARSE_BINS]
+    cdef unsigned short* add_fine
+    cdef unsigned short* sub_fine
+
+    if row_start >= row_stop:
+        return
+    memset(col_fine, 0, columns * FINE_BINS * sizeof(unsigned short))
+    memset(col_coarse, 0, columns * COARSE_BINS * sizeof(unsigned short))
+    for i in range(row_start - r, row_start + size - r):
+        _column_update(img, channels, _reflect(i, height), r, col_fine, col_coarse, 1)
+
+    for i in range(row_start, row_stop):
+        if i > row_start:
+            _column_update(img, channels, _reflect(i - r - 1, height), r, col_fine, col_coarse, -1)
+            _column_update(img, channels, _reflect(i + size - r - 1, height), r, col_fine, col_coarse, 1)
+
+        # Each channel slides its own window histogram along the row
+        for ch in range(channels):
+            first = ch * padded_width
+            memset(fine, 0, sizeof(fine))
+            memset(coarse, 0, sizeof(coarse))
+            for p in range(size):
+                h = first + p
+                for b in range(FINE_BINS):
+                    fine[b] += col_fine[h * FINE_BINS + b]
+                for b in range(COARSE_BINS):
+                    coarse[b] += col_coarse[h * COARSE_BINS + b]
+
+            for j in range(width):
+                if j > 0:
+                    add_fine = col_fine + (first + j + size - 1) * FINE_BINS
+                    sub_fine = col_fine + (first + j - 1) * FINE_BINS
+                    for b in range(FINE_BINS):
+                        fine[b] += add_fine[b] - sub_fine[b]
+                    for b in range(COARSE_BINS):
+                        coarse[b] += (col_coarse[(first + j + size - 1) * COARSE_BINS + b]
+                                      - col_coarse[(first + j - 1) * COARSE_BINS + b])
+
+                # Coarse scan finds the 16-value band holding the median, fine scan the value
+                count = 0
+                c = 0
+                while count + coarse[c] <= rank:
+                    count += coarse[c]
+                    c += 1
+                b = c * COARSE_BINS
+                while count + fine[b] <= rank:
+                    count += fine[b]
+                    b += 1
+                out[i, j * channels + ch] = <unsigned char>b
+
+
+cdef int _resolve_threads(int num_threads):
+    """Maps num_threads <= 0 to one thread per available core."""
+    if num_threads > 0:
+        return num_threads
+    return os.cpu_count() or 1
+
+
+def _as_rows(image) -> tuple:
+    """
+    Returns (rows, channels): the image as H x (W * C) rows of interleaved
+    samples, the layout every kernel works on. The rows are a view whenever
+    the channels are interleaved in memory, and a copy otherwise. Types
+    outside pixel_t (int16, uint16, int32, ...) are converted to float64.
+    """
+    image = np.asarray(image)
+    if image.dtype not in (np.uint8, np.float32, np.float64):
+        image = np.asarray(image, dtype=np.float64)
+    if image.ndim == 2:
+        return image, 1
+    if image.ndim != 3 or image.shape[2] == 0:
+        raise ValueError(f"expected an H x W or H x W x C image, got shape {image.shape}")
+    height, width, channels = image.shape
+    return image.reshape(height, width * channels), channels
+
+def _output_buffer(shape: tuple, out):
+    """Returns out once checked to be a C-contiguous uint8 array of the image's shape, else a new one."""
+    if out is None:
+        return np.empty(shape, dtype=np.uint8)
+    if out.dtype != np.uint8 or out.shape != tuple(shape) or not out.flags.c_contiguous:
+        raise ValueError(f"out must be a C-contiguous uint8 array of shape {tuple(shape)}")
+    return out
+
+@traced("cython")
+def read_image(path: str, mode: str = 'L', max_size=None, writable: bool = False) -> np.ndarray:
+    """
+    Reads an image as a uint8 NumPy array: H x W for mode 'L', H x W x C
+    for multi-channel modes such as 'RGB' or 'RGBA'. max_size, an int or a
+    (width, height) box, shrinks the image to fit, decoding JPEG files at
+    reduced scale (see image_io.open_image).
+    The array shares the decoded buffer and is read-only; writable=True
+    returns a copy that can be modified in place.
+    """
+    img = open_image(path, mode, max_size)
+    with stage("convert"):
+        return np.array(img) if writable else np.asarray(img)
+
+@traced("cython")
+def save_image(image: np.ndarray, path: str, **options) -> None:
+    """
+    Saves a NumPy array (H x W, or H x W x 3/4) as an image. options go to
+    PIL's Image.save, e.g. compress_level=1 for fast PNG encoding.
+    """
+    with stage("clip/cast"):
+        pixels = np.asarray(image).astype(np.uint8, copy=False)
+    with stage("encode"):
+        # PIL wraps contiguous L and RGBA arrays instead of copying them
+        Image.fromarray(pixels).save(path, **options)
+
+def create_gaussian_kernel(size: int, sigma: float = 1, separable: bool = False) -> np.ndarray:
+    """
+    Returns the (cached, read-only) Gaussian kernel from kernels.gaussian_kernel.
+    With separable=True the normalized 1D factor is returned instead of the 2D kernel.
+    """
+    return gaussian_kernel(size, sigma, separable, np.float64)
+
+def separable_factors(kernel, double tolerance=1e-9):
+    """
+    Returns (column, row) 1D factors whose outer product is the 2D kernel,
+    or None when the kernel is not separable (rank > 1).
+    """
+    kernel = np.asarray(kernel, dtype=np.float64)
+    if kernel.ndim != 2 or not kernel.any():
+        return None
+    u, s, vt = np.linalg.svd(kernel)
+    if s.size > 1 and s[1] > tolerance * s[0]:
+        return None
+    scale = np.sqrt(s[0])
+    return u[:, 0] * scale, vt[0] * scale
+
+@traced("cython")
+def apply_filter(image, kernel, int num_threads=1, str method="auto", out=None, scratch=None) -> np.ndarray:
+    """
+    Applies a zero-padded convolution filter to an image using Cython.
+    image is H x W or H x W x C (every channel filtered in the same pass).
+    method is "direct", "separable" (a 1D kernel, or a 2D kernel that
+    factors into two 1D kernels, runs as a row pass then a column pass),
+    "fft" (overlap-add, for large kernels) or "auto" to pick the fastest.
+    Native passes split rows across num_threads OpenMP threads (0 uses
+    every core); the FFT runs on one thread. The uint8 result is written
+    into out when given. scratch, a C-contiguous float64 array of the
+    image's shape, holds the intermediate of the separable passes.
+    """
+    from convolution import METHODS, choose_method, fft_convolve
+    if method not in METHODS:
+        raise ValueError(f"unknown method '{method}', expected one of {METHODS}")
+    image = np.asarray(image)
+    kernel = np.asarray(kernel, dtype=np.float64)
+    if kernel.ndim == 1:
+        factors = (kernel, kernel)
+        kernel = np.outer(kernel, kernel)
+    elif method in ("auto", "separable"):
+        factors = separable_factors(kernel)
+    else:
+        factors = None
+    cdef int threads = _resolve_threads(num_threads)
+    if method == "auto":
+        # The native passes scale with the threads, the FFT does not
+        method = choose_method(image.shape[:2], kernel.shape, factors is not None,
+                               FFT_MIN_TAPS * threads, FFT_MIN_SEPARABLE_TAPS * threads)
+
+    result = _output_buffer(image.shape, out)
+    if method == "fft":
+        with stage("compute"):
+            values = fft_convolve(image, kernel)
+            # Round off the FFT noise so exact results truncate like the direct pass
+            np.round(values, 6, out=values)
+        with stage("clip/cast"):
+            np.copyto(result, np.clip(values, 0, 255, out=values), casting='unsafe')
+        return result
+    if method == "separable" and factors is None:
+        raise ValueError("the kernel is not separable")
+    with stage("convert"):
+        rows, channels = _as_rows(image)
+        target = result.reshape(rows.shape)
+    # The native passes clip and truncate to uint8 as they write
+    with stage("compute"):
+        if method == "separable" or (method != "direct" and factors is not None):
+            _apply_separable(rows, channels, np.ascontiguousarray(factors[0], dtype=np.float64),
+                             np.ascontiguousarray(factors[1], dtype=np.float64), target, threads,
+                             None if scratch is None else scratch.reshape(rows.shape))
+        else:
+            _apply_direct(rows, channels, np.ascontiguousarray(kernel), target, threads)
+    return result
+
+def _apply_direct(const pixel_t[:, :] image, Py_ssize_t channels, const double[:, ::1] kernel,
+                  unsigned char[:, ::1] out, int threads):
+    """Direct 2D convolution, rows split across threads (k*k products per pixel)."""
+    cdef Py_ssize_t i
+    for i in prange(image.shape[0], nogil=True, num_threads=threads, schedule='static'):
+        _convolve_row(image, channels, kernel, out, i)
+
+def _apply_separable(const pixel_t[:, :] image, Py_ssize_t channels, const double[::1] column,
+                     const double[::1] row, unsigned char[:, ::1] out, int threads, scratch=None):
+    """Two 1D passes through a float64 scratch image (2k instead of k*k products per pixel)."""
+    if scratch is None:
+        scratch = np.empty((image.shape[0], image.shape[1]), dtype=np.float64)
+    cdef double[:, ::1] tmp = scratch
+    if tmp.shape[0] != image.shape[0] or tmp.shape[1] != image.shape[1]:
+        raise ValueError("scratch must be a float64 array of the image's shape")
+    cdef Py_ssize_t i
+    for i in prange(image.shape[0], nogil=True, num_threads=threads, schedule='static'):
+        _convolve_row_1d(image, channels, row, tmp, i)
+    for i in prange(image.shape[0], nogil=True, num_threads=threads, schedule='static'):
+        _convolve_col_1d(tmp, column, out, i)
+
+def _box_cascade(const pixel_t[:, :] image, Py_ssize_t channels, const Py_ssize_t[::1] radii,
+                 unsigned char[:, ::1] out, int threads):
+    """
+    Box passes of the given radii: every row through all the horizontal
+    passes, then the vertical passes over horizontal strips, one per thread.
+    The image is zero-padded by the sum of the radii so nothing that spreads
+    past the edges is lost between passes.
+    """
+    cdef Py_ssize_t height = image.shape[0], row_len = image.shape[1]
+    cdef Py_ssize_t margin = sum(radii) if radii.shape[0] > 1 else 0
+    cdef Py_ssize_t rows = height + 2 * margin, length = row_len + 2 * margin * channels
+    cdef Py_ssize_t strips = min(threads, max(rows, 1))
+    cdef Py_ssize_t strip_rows, first, stop, k, i, s, start, end
+    cdef double[:, ::1] src = np.zeros((rows, row_len), dtype=np.float64)
+    cdef double[:, ::1] dst = np.zeros((rows, row_len), dtype=np.float64)
+    cdef double[:, ::1] swap
+    cdef bint last
+    cdef double* lines = <double*>malloc(threads * 2 * length * sizeof(double))
+    cdef double* sums = <double*>malloc(strips * row_len * sizeof(double))
+    if lines == NULL or sums == NULL:
+        free(lines)
+        free(sums)
+        raise MemoryError()
+    try:
+        for i in prange(height, nogil=True, num_threads=threads, schedule='static'):
+            _box_row(image, channels, radii, margin, lines + threadid() * 2 * length,
+                     lines + (threadid() * 2 + 1) * length, src, i)
+        for k in range(radii.shape[0]):
+            last = k == radii.shape[0] - 1
+            # The last pass only computes the rows of the image
+            first = margin if last else 0
+            stop = margin + height if last else rows
+            strip_rows = (stop - first + strips - 1) // strips
+            for s in prange(strips, nogil=True, num_threads=strips, schedule='static', chunksize=1):
+                start = first + s * strip_rows
+                end = start + strip_rows if start + strip_rows < stop else stop
+                _box_columns(src, radii[k], start, end, sums + s * row_len, dst, out, margin, last)
+            swap = src
+            src = dst
+            dst = swap
+    finally:
+        free(lines)
+        free(sums)
+
+@traced("cython")
+def apply_box_filter(image, int radius, int passes=1, int num_threads=1, out=None) -> np.ndarray:
+    """
+    Mean over the (2 radius + 1)^2 window of every pixel, zero-padded like
+    apply_filter, repeated `passes` times, as uint8. Running sums make the
+    cost independent of the radius.
+    """
+    if radius < 0 or passes < 1:
+        raise ValueError(f"expected radius >= 0 and passes >= 1, got {radius} and {passes}")
+    return _box_filter(image, (radius,) * passes, num_threads, out)
+
+@traced("cython")
+def apply_gaussian(image, size=9, sigma=3, str mode="exact", int num_threads=1, out=None) -> np.ndarray:
+    """
+    Gaussian blur. mode="exact" applies create_gaussian_kernel(size, sigma)
+    with apply_filter; mode="fast" approximates the (untruncated) Gaussian
+    of this sigma with three box passes whose cost does not grow with sigma,
+    ignoring size, within the error bounds documented in kernels.py. Below
+    kernels.FAST_GAUSSIAN_MIN_SIGMA the fast mode uses the exact kernel.
+    """
+    if gaussian_mode(mode) == "fast" and sigma >= FAST_GAUSSIAN_MIN_SIGMA:
+        return _box_filter(image, box_radii(float(sigma)), num_threads, out)
+    return apply_filter(image, create_gaussian_kernel(size, sigma, separable=True), num_threads, out=out)
+
+def _box_filter(image, radii: tuple, int num_threads, out):
+    with stage("convert"):
+        rows, channels = _as_rows(image)
+        result = _output_buffer(np.shape(image), out)
+    with stage("compute"):
+        _box_cascade(rows, channels, np.array(radii, dtype=np.intp), result.reshape(rows.shape),
+                     _resolve_threads(num_threads))
+    return result
+
+@traced("cython")
+def apply_sobel(image, int num_threads=1, out=None, str magnitude="exact") -> np.ndarray:
+    """
+    Applies the Sobel filter to detect edges in an H x W or H x W x C image,
+    splitting rows across num_threads threads. The uint8 result is written
+    into out when given.
+    magnitude is "exact" (truncated sqrt(gx^2 + gy^2)), "l1" (|gx| + |gy|)
+    or "max_min" (max + min / 2, within about 12% of exact).
+    8-bit input runs in integers, with the square root read from a table.
+    """
+    cdef int mode = sobel_magnitude_mode(magnitude)
+    with stage("convert"):
+        rows, channels = _as_rows(image)
+        result = _output_buffer(np.shape(image), out)
+    with stage("compute"):
+        _sobel(rows, channels, result.reshape(rows.shape), _resolve_threads(num_threads), mode)
+    return result
+
+def _sobel(const pixel_t[:, :] image, Py_ssize_t channels, unsigned char[:, ::1] out, int threads, int mode):
+    cdef Py_ssize_t i
+    if pixel_t is float or pixel_t is double:
+        for i in prange(image.shape[0], nogil=True, num_threads=threads, schedule='static'):
+            _sobel_row(image, channels, out, i, mode)
+    else:
+        _sobel_integer(image, channels, out, threads, mode)
+
+cdef int _sobel_integer(const unsigned char[:, :] image, Py_ssize_t channels, unsigned char[:, ::1] out,
+                        int threads, int mode) except -1:
+    """Runs _sobel_row_u8 over every row with private column-sum rows per thread."""
+    cdef bytes table = sqrt_table()
+    cdef const unsigned char* table_ptr = table
+    cdef Py_ssize_t row_len = image.shape[1] + 2 * channels
+    cdef Py_ssize_t i
+    # Two rows (smooth, diff) per thread, from a single allocation
+    cdef int* sums = <int*>malloc(threads * 2 * row_len * sizeof(int))
+    if sums == NULL:
+        raise MemoryError()
+    try:
+        for i in prange(image.shape[0], nogil=True, num_threads=threads, schedule='static'):
+            _sobel_row_u8(image, channels, sums + threadid() * 2 * row_len, sums + (threadid() * 2 + 1) * row_len,
+                          table_ptr, out, i, mode)
+    finally:
+        free(sums)
+    return 0
+
+@traced("cython")
+def apply_median_filter(image, int size, int num_threads=1, str method="auto", out=None) -> np.ndarray:
+    """
+    Applies a median filter to an H x W or H x W x C image (each channel on
+    its own), splitting rows across num_threads threads. The uint8 result
+    is written into out when given.
+    method="histogram" uses a sliding-histogram median whose cost does not grow
+    with the window, method="sort" selects the median of every window, and
+    "auto" picks the histogram for windows of HISTOGRAM_MEDIAN_MIN_SIZE and up.
+    """
+    if size < 1:
+        raise ValueError("size must be a positive integer")
+    if method == "auto":
+        method = "histogram" if HISTOGRAM_MEDIAN_MIN_SIZE <= size <= MAX_HISTOGRAM_SIZE else "sort"
+    if method not in ("histogram", "sort"):
+        raise ValueError(f"unknown median method '{method}'")
+    if method == "histogram" and size > MAX_HISTOGRAM_SIZE:
+        raise ValueError(f"histogram median supports sizes up to {MAX_HISTOGRAM_SIZE}")
+    if np.size(image) == 0:
+        # The border reflection divides by the width, which is 0 here
+        return _output_buffer(np.shape(image), out)
+
+    cdef int threads = _resolve_threads(num_threads)
+    with stage("convert"):
+        rows, channels = _as_rows(image)
+        result = _output_buffer(np.shape(image), out)
+        target = result.reshape(rows.shape)
+        if method == "histogram" and rows.dtype != np.uint8:
+            # The output is clipped and truncated to uint8 anyway, and the median
+            # commutes with that monotonic mapping, so converting first is exact
+            rows = np.clip(rows, 0, 255).astype(np.uint8)
+    with stage("compute"):
+        if method == "sort":
+            _median_sort(rows, channels, size, target, threads)
+        else:
+            _median_histogram(rows, channels, size, target, threads)
+    return result
+
+def _median_sort(const pixel_t[:, :] image, Py_ssize_t channels, int size, unsigned char[:, ::1] out,
+                 int threads):
+    """Selects the median of every window, rows split across threads."""
+    cdef Py_ssize_t i
+    cdef Py_ssize_t window_len = size * size
+    # One private scratch window per thread, gathered from a single allocation
+    cdef double* windows = <double*>malloc(threads * window_len * sizeof(double))
+    if windows == NULL:
+        raise MemoryError()
+    try:
+        for i in prange(image.shape[0], nogil=True, num_threads=threads, schedule='static'):
+            _median_row(image, channels, size, windows + threadid() * window_len, out, i)
+    finally:
+        free(windows)
+
+def _median_histogram(const unsigned char[:, :] image, Py_ssize_t channels, int size, unsigned char[:, ::1] out,
+                      int threads):
+    """Histogram median with the rows cut into one horizontal strip per thread."""
+    cdef Py_ssize_t height = image.shape[0]
+    cdef Py_ssize_t columns = image.shape[1] + 2 * (size // 2) * channels
+    cdef Py_ssize_t strips = min(threads, max(height, 1))
+    cdef Py_ssize_t strip_rows = (height + strips - 1) // strips
+    cdef Py_ssize_t s, start, stop
+    cdef unsigned short* col_fine = <unsigned short*>malloc(
+        strips * columns * FINE_BINS * sizeof(unsigned short))
+    cdef unsigned short* col_coarse = <unsigned short*>malloc(
+        strips * columns * COARSE_BINS * sizeof(unsigned short))
+    if col_fine == NULL or col_coarse == NULL:
+        free(col_fine)
+        free(col_coarse)
+        raise MemoryError()
+    try:
+        for s in prange(strips, nogil=True, num_threads=strips, schedule='static', chunksize=1):
+            start = s * strip_rows
+            stop = start + strip_rows if start + strip_rows < height else height
+            _median_histogram_rows(image, channels, size, start, stop,
+                                   col_fine + s * columns * FINE_BINS,
+                                   col_coarse + s * columns * COARSE_BINS, out)
+    finally:
+        free(col_fine)
+        free(col_coarse)
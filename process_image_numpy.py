@@ -1,38 +1,402 @@
+from functools import lru_cache
+
 import numpy as np
 from PIL import Image
 
+from image_io import open_image
+from instrumentation import stage, traced
+from kernels import FAST_GAUSSIAN_MIN_SIGMA, box_radii, gaussian_kernel, gaussian_mode, sobel_magnitude_mode
+
 SOBEL_X = np.array([[-1, 0, 1], [-2, 0, 2], [-1, 0, 1]])
 SOBEL_Y = np.array([[-1, -2, -1], [0, 0, 0], [1, 2, 1]])
 
-def read_image(path: str) -> np.ndarray:
-    """Reads a grayscale image and returns it as a 2D NumPy array."""
-    img = Image.open(path).convert('L')
-    return np.array(img, dtype=np.float32)
-
-def save_image(image: np.ndarray, path: str) -> None:
-    """Saves a NumPy array as a grayscale image."""
-    img = Image.fromarray(image.astype(np.uint8))
-    img.save(path)
-
-def create_gaussian_kernel(size: int, sigma: float = 1) -> np.ndarray:
-    """Creates a Gaussian kernel."""
-    ax = np.linspace(-(size // 2), size // 2, size)
-    xx, yy = np.meshgrid(ax, ax)
-    kernel = np.exp(-(xx**2 + yy**2) / (2 * sigma**2))
-    return kernel / kernel.sum()
-
-def apply_filter(image: np.ndarray, kernel: np.ndarray) -> np.ndarray:
-    """Applies a convolution filter to an image using NumPy."""
-    from scipy.ndimage import convolve
-    return convolve(image, kernel, mode='constant', cval=0.0)
-
-def apply_sobel(image: np.ndarray) -> np.ndarray:
-    """Applies the Sobel filter to detect edges."""
-    grad_x = apply_filter(image, SOBEL_X)
-    grad_y = apply_filter(image, SOBEL_Y)
-    return np.clip(np.sqrt(grad_x**2 + grad_y**2), 0, 255)
-
-def apply_median_filter(image: np.ndarray, size: int) -> np.ndarray:
-    """Applies a median filter to an image."""
-    from scipy.ndimage import median_filter
-    return median_filter(image, size=size)
+# Window size from which the histogram median beats scipy's median_filter
+HISTOGRAM_MEDIAN_MIN_SIZE = 13
+# Window counts are kept in 16 bits
+MAX_HISTOGRAM_SIZE = 255
+# Multiply-adds per pixel from which FFT convolution beats direct / separable passes
+FFT_MIN_TAPS = 25
+FFT_MIN_SEPARABLE_TAPS = 48
+
+@traced("numpy")
+def read_image(path: str, mode: str = 'L', max_size=None, writable: bool = False) -> np.ndarray:
+    """
+    Reads an image as a uint8 NumPy array: H x W for mode 'L', H x W x C
+    for multi-channel modes such as 'RGB' or 'RGBA'. max_size, an int or a
+    (width, height) box, shrinks the image to fit, decoding JPEG files at
+    reduced scale (see image_io.open_image).
+    The array shares the decoded buffer and is read-only; writable=True
+    returns a copy that can be modified in place.
+    """
+    img = open_image(path, mode, max_size)
+    with stage("convert"):
+        return np.array(img) if writable else np.asarray(img)
+
+@traced("numpy")
+def save_image(image: np.ndarray, path: str, **options) -> None:
+    """
+    Saves a NumPy array (H x W, or H x W x 3/4) as an image. options go to
+    PIL's Image.save, e.g. compress_level=1 for fast PNG encoding.
+    """
+    with stage("clip/cast"):
+        pixels = np.asarray(image).astype(np.uint8, copy=False)
+    with stage("encode"):
+        # PIL wraps contiguous L and RGBA arrays instead of copying them
+        Image.fromarray(pixels).save(path, **options)
+
+def create_gaussian_kernel(size: int, sigma: float = 1, separable: bool = False) -> np.ndarray:
+    """
+    Returns the (cached, read-only) Gaussian kernel from kernels.gaussian_kernel.
+    With separable=True the normalized 1D factor is returned instead of the 2D kernel.
+    """
+    return gaussian_kernel(size, sigma, separable, np.float64)
+
+def separable_factors(kernel: np.ndarray, tolerance: float = 1e-9):
+    """
+    Returns (column, row) 1D factors whose outer product is the 2D kernel,
+    or None when the kernel is not separable (rank > 1).
+    """
+    kernel = np.asarray(kernel, dtype=np.float64)
+    if kernel.ndim != 2 or not kernel.any():
+        return None
+    u, s, vt = np.linalg.svd(kernel)
+    if s.size > 1 and s[1] > tolerance * s[0]:
+        return None
+    scale = np.sqrt(s[0])
+    return u[:, 0] * scale, vt[0] * scale
+
+@lru_cache(maxsize=1)
+def _ndimage():
+    """scipy.ndimage, imported on first use: it takes longer to import than the rest of the backend."""
+    import scipy.ndimage
+    return scipy.ndimage
+
+def _work_dtype(image: np.ndarray):
+    """Accumulator type: the image's own float type, float32 for 8-bit data."""
+    return image.dtype if image.dtype.kind == 'f' else np.dtype(np.float32)
+
+def _buffer(scratch: dict, key: str, shape: tuple, dtype) -> np.ndarray:
+    """
+    An uninitialized array of this shape and dtype: scratch[key] when it
+    already is one, otherwise a new array, kept in scratch (a dict, or None
+    to keep nothing) for the next call.
+    """
+    dtype = np.dtype(dtype)
+    buffer = None if scratch is None else scratch.get(key)
+    if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+        buffer = np.empty(shape, dtype=dtype)
+        if scratch is not None:
+            scratch[key] = buffer
+    return buffer
+
+def _finish(result: np.ndarray, image: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    """
+    Converts a filter result to the output convention: float input keeps
+    its dtype, integer input gives uint8 (clipped and truncated, like the
+    Cython backend). With out, the result is written there instead.
+    """
+    if result is out:
+        return out
+    target_dtype = out.dtype if out is not None else (image.dtype if image.dtype.kind == 'f' else np.dtype(np.uint8))
+    if target_dtype.kind != 'f':
+        np.clip(result, 0, 255, out=result)
+    if out is None:
+        return result.astype(target_dtype, copy=False)
+    np.copyto(out, result, casting='unsafe')
+    return out
+
+@traced("numpy")
+def apply_filter(image: np.ndarray, kernel: np.ndarray, method: str = "auto", out: np.ndarray = None,
+                 scratch: dict = None) -> np.ndarray:
+    """
+    Applies a zero-padded convolution filter to an image using NumPy.
+    method is "direct", "separable" (a 1D kernel, or a 2D kernel that
+    factors into two 1D kernels, runs as a row pass then a column pass),
+    "fft" (overlap-add, for large kernels) or "auto" to pick the fastest.
+    An H x W x C image has all its channels filtered in the same pass.
+    uint8 input is filtered without converting it first (float32
+    accumulation) and gives a uint8 result; out receives the result.
+    scratch, a dict, keeps the intermediate images of the separable and
+    direct passes between calls, so repeated calls with out allocate nothing.
+    """
+    from convolution import METHODS, choose_method, fft_convolve
+    if method not in METHODS:
+        raise ValueError(f"unknown method '{method}', expected one of {METHODS}")
+    kernel = np.asarray(kernel)
+    if kernel.ndim == 1:
+        factors = (kernel, kernel)
+    elif method in ("auto", "separable"):
+        factors = separable_factors(kernel)
+    else:
+        factors = None
+    shape = (len(kernel), len(kernel)) if kernel.ndim == 1 else kernel.shape
+    if method == "auto":
+        method = choose_method(image.shape[:2], shape, factors is not None, FFT_MIN_TAPS, FFT_MIN_SEPARABLE_TAPS)
+
+    work = _work_dtype(image)
+    # The last pass writes straight into out when it already has the accumulator type. The
+    # result only lives in scratch when it is copied to out, never when it is returned
+    if out is not None and out.dtype == work:
+        final = out
+    else:
+        final = _buffer(scratch if out is not None else None, "result", image.shape, work)
+    if method == "separable" and factors is None:
+        raise ValueError("the kernel is not separable")
+    ndimage = _ndimage()
+    with stage("compute"):
+        if method == "fft":
+            result = fft_convolve(image, np.outer(kernel, kernel) if kernel.ndim == 1 else kernel)
+            if image.dtype.kind != 'f':
+                # Round off the FFT noise so exact results truncate like the direct pass
+                np.round(result, 6, out=result)
+        elif method == "direct" or factors is None:
+            kernel2d = np.outer(kernel, kernel) if kernel.ndim == 1 else kernel
+            # A trailing unit axis leaves the channels of an H x W x C image apart
+            result = ndimage.convolve(image, kernel2d.reshape(kernel2d.shape + (1,) * (image.ndim - 2)),
+                                      output=final, mode='constant', cval=0.0)
+        else:
+            column, row = factors
+            rows_done = ndimage.convolve1d(image, row, axis=1, output=_buffer(scratch, "rows", image.shape, work),
+                                           mode='constant', cval=0.0)
+            result = ndimage.convolve1d(rows_done, column, axis=0, output=final, mode='constant', cval=0.0)
+    with stage("clip/cast"):
+        return _finish(result, image, out)
+
+def summed_area_table(image: np.ndarray, pad: int = 0, out: np.ndarray = None) -> np.ndarray:
+    """
+    Returns the float64 summed-area table T of an H x W (x C) image, with
+    T[pad + i, pad + j] = image[:i, :j].sum(axis=(0, 1)). The table is
+    (H + 1 + 2 pad) x (W + 1 + 2 pad) (x C), its borders repeating the edge
+    values, so any window sum, even one crossing the image edges (zero
+    padding), is T[b, d] - T[a, d] - T[b, c] + T[a, c]. out, a float64
+    array of that shape, receives the table.
+    """
+    height, width = image.shape[:2]
+    shape = (height + 1 + 2 * pad, width + 1 + 2 * pad) + image.shape[2:]
+    table = np.empty(shape, dtype=np.float64) if out is None else out
+    if table.shape != shape or table.dtype != np.float64:
+        raise ValueError(f"out must be a float64 array of shape {shape}")
+    top = left = pad + 1
+    core = table[top:top + height, left:left + width]
+    np.cumsum(image, axis=1, dtype=np.float64, out=core)
+    # Row by row: np.cumsum(axis=0) walks every column with a stride of a whole row
+    add = np.add
+    for i in range(1, height):
+        add(core[i - 1], core[i], out=core[i])
+    table[pad, pad:] = 0
+    table[top:top + height, pad] = 0
+    # Sums over the zero padding stay at the edge values
+    table[top:top + height, left + width:] = table[top:top + height, left + width - 1:left + width]
+    table[:pad] = table[pad]
+    table[top + height:] = table[top + height - 1]
+    table[:, :pad] = table[:, pad:pad + 1]
+    return table
+
+def _box_pass(image: np.ndarray, radius: int, result: np.ndarray, table: np.ndarray = None) -> np.ndarray:
+    """
+    One zero-padded box mean of side 2 * radius + 1 into the float64
+    result, in O(1) per pixel. table is a flat float64 buffer at least as
+    large as the summed-area table, reused across passes.
+    """
+    height, width = image.shape[:2]
+    side = 2 * radius + 1
+    if table is not None:
+        shape = (height + side, width + side) + image.shape[2:]
+        table = table[:int(np.prod(shape))].reshape(shape)
+    table = summed_area_table(image, radius, table)
+    np.subtract(table[side:side + height, side:side + width], table[:height, side:side + width], out=result)
+    result -= table[side:side + height, :width]
+    result += table[:height, :width]
+    result *= 1.0 / (side * side)
+    return result
+
+def _box_cascade(image: np.ndarray, radii: tuple, out: np.ndarray = None) -> np.ndarray:
+    """
+    Box passes of the given radii in float64, then the output conversion of
+    _finish. The passes run on the image zero-padded by the sum of the radii,
+    so nothing that spreads past the edges is lost between passes and the
+    result is the zero-padded convolution with the combined kernel.
+    """
+    height, width = image.shape[:2]
+    margin = sum(radii) if len(radii) > 1 else 0
+    with stage("pad"):
+        current = np.pad(image, ((margin, margin), (margin, margin)) + ((0, 0),) * (image.ndim - 2))
+        result = np.empty(current.shape, dtype=np.float64)
+        side = 2 * max(radii) + 1
+        table = np.empty((current.shape[0] + side) * (current.shape[1] + side) * result[:1, :1].size)
+    with stage("compute"):
+        for radius in radii:
+            current = _box_pass(current, radius, result, table)
+    with stage("clip/cast"):
+        return _finish(result[margin:margin + height, margin:margin + width], image, out)
+
+@traced("numpy")
+def apply_box_filter(image: np.ndarray, radius: int, passes: int = 1, out: np.ndarray = None) -> np.ndarray:
+    """
+    Mean over the (2 radius + 1)^2 window of every pixel, zero-padded like
+    apply_filter, repeated `passes` times. Each pass reads a summed-area
+    table, so the cost does not depend on the radius. uint8 input gives
+    uint8 (truncated), float input keeps its dtype.
+    """
+    if radius < 0 or passes < 1:
+        raise ValueError(f"expected radius >= 0 and passes >= 1, got {radius} and {passes}")
+    return _box_cascade(image, (int(radius),) * passes, out)
+
+@traced("numpy")
+def apply_gaussian(image: np.ndarray, size: int = 9, sigma: float = 3, mode: str = "exact",
+                   out: np.ndarray = None) -> np.ndarray:
+    """
+    Gaussian blur. mode="exact" applies create_gaussian_kernel(size, sigma)
+    with apply_filter; mode="fast" approximates the (untruncated) Gaussian
+    of this sigma with three box passes whose cost does not grow with sigma,
+    ignoring size, within the error bounds documented in kernels.py. Below
+    kernels.FAST_GAUSSIAN_MIN_SIGMA the fast mode uses the exact kernel.
+    """
+    if gaussian_mode(mode) == "fast" and sigma >= FAST_GAUSSIAN_MIN_SIGMA:
+        return _box_cascade(image, box_radii(float(sigma)), out)
+    return apply_filter(image, create_gaussian_kernel(size, sigma, separable=True), out=out)
+
+def _sobel_gradients(image: np.ndarray, dtype, scratch: dict = None) -> tuple:
+    """
+    Zero-padded Sobel gradients (gx, gy) in one sweep. The kernels factor as
+    [1,2,1] x [-1,0,1], so the vertical sum and difference of every column
+    are formed once and both gradients are short horizontal combinations.
+    The padding, the intermediates and the gradients are kept in scratch
+    (see _buffer).
+    """
+    height, width = image.shape[:2]
+    channels = image.shape[2:]
+    with stage("pad"):
+        padded = _buffer(scratch, "padded", (height + 2, width + 2) + channels, dtype)
+        # Slices, not index lists, which numpy would copy into index arrays first
+        padded[0] = padded[-1] = 0
+        padded[:, 0] = padded[:, -1] = 0
+        padded[1:-1, 1:-1] = image
+    with stage("compute"):
+        smooth = np.add(padded[:-2], padded[2:], out=_buffer(scratch, "smooth", (height, width + 2) + channels, dtype))
+        smooth += padded[1:-1]
+        smooth += padded[1:-1]
+        diff = np.subtract(padded[2:], padded[:-2], out=_buffer(scratch, "diff", smooth.shape, dtype))
+        grad_x = np.subtract(smooth[:, 2:], smooth[:, :-2], out=_buffer(scratch, "grad_x", image.shape, dtype))
+        grad_y = np.add(diff[:, :-2], diff[:, 2:], out=_buffer(scratch, "grad_y", image.shape, dtype))
+        grad_y += diff[:, 1:-1]
+        grad_y += diff[:, 1:-1]
+    return grad_x, grad_y
+
+@traced("numpy")
+def apply_sobel(image: np.ndarray, out: np.ndarray = None, magnitude: str = "exact",
+                scratch: dict = None) -> np.ndarray:
+    """
+    Applies the Sobel filter to detect edges in an H x W or H x W x C
+    image; out receives the result.
+    magnitude is "exact" (sqrt(gx^2 + gy^2)), "l1" (|gx| + |gy|) or
+    "max_min" (max + min / 2, within about 12% of exact).
+    8-bit input runs in int16 (gradients are at most 4 * 255 in magnitude)
+    and gives uint8; float input keeps its dtype. scratch, a dict, keeps
+    the padding and gradient images between calls, so repeated calls with
+    out allocate nothing.
+    """
+    sobel_magnitude_mode(magnitude)
+    integer = image.dtype == np.uint8
+    grad_x, grad_y = _sobel_gradients(image, np.int16 if integer else _work_dtype(image), scratch)
+    # The result only lives in scratch when it is copied to out, never when it is returned
+    kept = scratch if out is not None else None
+    with stage("compute"):
+        if magnitude == "exact":
+            # float32 holds every squared 8-bit gradient (< 2**24) exactly, so the root truncates exactly too
+            square_dtype = np.dtype(np.float32 if integer else grad_x.dtype)
+            result = np.square(grad_x, out=_buffer(kept, "result", image.shape, square_dtype), dtype=square_dtype)
+            result += np.square(grad_y, out=_buffer(scratch, "square", image.shape, square_dtype), dtype=square_dtype)
+            np.sqrt(result, out=result)
+        else:
+            result = np.abs(grad_x, out=grad_x if scratch is None else _buffer(kept, "result", image.shape, grad_x.dtype))
+            np.abs(grad_y, out=grad_y)
+            if magnitude == "l1":
+                result += grad_y
+            else:
+                low = np.minimum(result, grad_y, out=_buffer(scratch, "low", image.shape, grad_y.dtype))
+                np.maximum(result, grad_y, out=result)
+                if integer:
+                    low >>= 1
+                else:
+                    low /= 2
+                result += low
+    with stage("clip/cast"):
+        # Magnitudes are never negative, only the top needs clipping
+        np.minimum(result, 255, out=result)
+        return _finish(result, image, out)
+
+def _as_uint8(image: np.ndarray):
+    """Returns the image as uint8 if that loses nothing, otherwise None."""
+    if image.dtype == np.uint8:
+        return image
+    converted = image.astype(np.uint8)
+    return converted if np.array_equal(converted, image) else None
+
+def _median_histogram(image: np.ndarray, size: int) -> np.ndarray:
+    """
+    Sliding-histogram median for uint8 images with scipy's 'reflect' borders.
+    One 256-bin histogram per column (and channel) slides down the image;
+    the window histograms of a whole row come from a cumulative sum over
+    the columns, so the work per pixel does not depend on the window size.
+    """
+    radius = size // 2
+    rank = (size * size) // 2
+    pixels = image if image.ndim == 3 else image[:, :, None]
+    height, width, channels = pixels.shape
+    # Even sizes reach one pixel further back than forward, as in scipy
+    with stage("pad"):
+        padded = np.pad(pixels, ((radius, size - 1 - radius), (radius, size - 1 - radius), (0, 0)), mode='symmetric')
+    with stage("compute"):
+        columns = np.arange(padded.shape[1])[:, None]
+        planes = np.arange(channels)
+
+        # uint16 counts: the cumulative sum wraps, but window differences stay exact
+        column_hist = np.zeros((padded.shape[1], channels, 256), dtype=np.uint16)
+        for y in range(size):
+            np.add.at(column_hist, (columns, planes, padded[y]), 1)
+
+        cumulative = np.zeros((padded.shape[1] + 1, channels, 256), dtype=np.uint16)
+        result = np.empty((height, width, channels), dtype=np.uint8)
+        for i in range(height):
+            if i > 0:
+                column_hist[columns, planes, padded[i - 1]] -= 1
+                column_hist[columns, planes, padded[i + size - 1]] += 1
+            np.cumsum(column_hist, axis=0, dtype=np.uint16, out=cumulative[1:])
+            window_hist = cumulative[size:] - cumulative[:-size]
+            cdf = np.cumsum(window_hist, axis=2, dtype=np.uint16)
+            # The median is the first value whose cumulative count exceeds the rank
+            result[i] = np.count_nonzero(cdf <= rank, axis=2)
+    return result.reshape(image.shape)
+
+@traced("numpy")
+def apply_median_filter(image: np.ndarray, size: int, method: str = "auto", out: np.ndarray = None) -> np.ndarray:
+    """
+    Applies a median filter to an image, keeping its dtype (out receives the result).
+    H x W x C images are filtered channel by channel in the same pass.
+    method="histogram" uses a sliding-histogram median whose cost does not
+    grow with the window (8-bit data only), method="sort" uses SciPy, and
+    "auto" picks the histogram for 8-bit data and windows of
+    HISTOGRAM_MEDIAN_MIN_SIZE and up.
+    """
+    if method not in ("auto", "histogram", "sort"):
+        raise ValueError(f"unknown median method '{method}'")
+    if method == "histogram" and size > MAX_HISTOGRAM_SIZE:
+        raise ValueError(f"histogram median supports sizes up to {MAX_HISTOGRAM_SIZE}")
+    # An empty image has no histogram to slide and goes straight to SciPy, which returns it empty
+    if method != "sort" and image.size and size <= MAX_HISTOGRAM_SIZE and (method == "histogram" or size >= HISTOGRAM_MEDIAN_MIN_SIZE):
+        with stage("convert"):
+            pixels = _as_uint8(image)
+        if pixels is not None:
+            result = _median_histogram(pixels, size)
+            with stage("clip/cast"):
+                if out is None:
+                    return result.astype(image.dtype, copy=False)
+                np.copyto(out, result, casting='unsafe')
+                return out
+        if method == "histogram":
+            raise ValueError("histogram median needs integer pixel values in 0-255")
+    ndimage = _ndimage()
+    with stage("compute"):
+        # A window of one along the channel axis keeps the channels apart
+        return ndimage.median_filter(image, size=(size, size) + (1,) * (image.ndim - 2), output=out)
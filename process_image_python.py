@@ -1,10 +1,15 @@
 """
 PIL for image processing
-math for calculating specific data
+array for the scratch rows of the separable filter
+kernels for the Gaussian kernels and Sobel square roots shared with the other backends
 """
 
 from PIL import Image
-import math
+from array import array
+
+from image_io import open_image
+from instrumentation import stage, traced
+from kernels import MAX_SQUARED_MAGNITUDE, gaussian_kernel, sobel_magnitude_mode, sqrt_table
 
 
 SOBEL_X = [
@@ -19,23 +24,77 @@ SOBEL_Y = [
     [1, 2, 1]
 ]
 
-def read_image(path:str) -> list:
-    """Reads a grayscale image and returns it as a 2D list."""
-    img = Image.open(path).convert('L')
-    width, height = img.size
-    pixels = list(img.getdata())
-    # Convert flat list to 2D list (height x width)
-    return [pixels[i*width : (i+1)*width] for i in range(height)]
-
-def save_image(image:list, path:str) -> None:
-    """Saves a 2D list (grayscale image) to a file."""
-    height = len(image)
-    width = len(image[0]) if height > 0 else 0
-    # Flatten the 2D list into a 1D list
-    pixels = [pixel for row in image for pixel in row]
-    img = Image.new('L', (width, height))
-    img.putdata(pixels)
-    img.save(path)
+class FlatImage:
+    """
+    Image stored as one row-major bytearray (1 byte per sample) with the
+    channels interleaved. Sample c of pixel (i, j) lives at
+    data[(i * width + j) * channels + c]; grayscale images have 1 channel.
+    """
+
+    __slots__ = ("width", "height", "data", "channels")
+
+    def __init__(self, width:int, height:int, data=None, channels:int=1):
+        self.width = width
+        self.height = height
+        self.channels = channels
+        size = width * height * channels
+        self.data = bytearray(size) if data is None else bytearray(data)
+        if len(self.data) != size:
+            raise ValueError(f"expected {size} bytes, got {len(self.data)}")
+
+    @classmethod
+    def from_rows(cls, rows:list) -> "FlatImage":
+        """
+        Builds an image from a 2D list of values, or of per-pixel channel
+        lists such as [r, g, b], clamping values to 0-255.
+        """
+        height = len(rows)
+        width = len(rows[0]) if height > 0 else 0
+        first = rows[0][0] if width > 0 else 0
+        if isinstance(first, (list, tuple)):
+            channels = len(first)
+            values = (p for row in rows for pixel in row for p in pixel)
+        else:
+            channels = 1
+            values = (p for row in rows for p in row)
+        return cls(width, height, bytes(max(0, min(int(p), 255)) for p in values), channels)
+
+    def to_rows(self) -> list:
+        """Returns the pixels as a 2D list (height x width), of channel lists if channels > 1."""
+        w, c = self.width, self.channels
+        if c == 1:
+            return [list(self.data[i * w:(i + 1) * w]) for i in range(self.height)]
+        return [[list(self.data[k:k + c]) for k in range(i * w * c, (i + 1) * w * c, c)]
+                for i in range(self.height)]
+
+# PIL mode of a FlatImage with that many channels
+PIL_MODES = {1: 'L', 2: 'LA', 3: 'RGB', 4: 'RGBA'}
+
+def _as_image(image) -> FlatImage:
+    """Accepts a FlatImage or a 2D list of pixels."""
+    return image if isinstance(image, FlatImage) else FlatImage.from_rows(image)
+
+@traced("python")
+def read_image(path:str, mode:str='L', max_size=None) -> FlatImage:
+    """
+    Reads an image converted to mode ('L', 'RGB', 'RGBA'...) and returns it as a FlatImage.
+    max_size, an int or a (width, height) box, shrinks it to fit (see image_io.open_image).
+    """
+    img = open_image(path, mode, max_size)
+    with stage("convert"):
+        width, height = img.size
+        return FlatImage(width, height, img.tobytes(), len(img.getbands()))
+
+@traced("python")
+def save_image(image, path:str, **options) -> None:
+    """Saves a FlatImage (or 2D list) as a grayscale or color image; options go to PIL's Image.save."""
+    with stage("convert"):
+        image = _as_image(image)
+        mode = PIL_MODES[image.channels]
+        # Reads the bytearray in place instead of copying it
+        img = Image.frombuffer(mode, (image.width, image.height), image.data, "raw", mode, 0, 1)
+    with stage("encode"):
+        img.save(path, **options)
     return None
 
 def multiply(matrix_a, matrix_b) -> list:
@@ -51,125 +110,225 @@ def multiply(matrix_a, matrix_b) -> list:
     
     return result
 
-def create_gaussian_kernel(size, sigma=1) -> list:
-    """Creates a Gaussian kernel of the specified size."""
-    kernel = [[0] * size for _ in range(size)]
-    center = size // 2
-    sum_val = 0.0
-
-    for i in range(size):
-        for j in range(size):
-            x = i - center
-            y = j - center
-            kernel[i][j] = math.exp(-(x**2 + y**2) / (2 * sigma**2+2))
-            sum_val += kernel[i][j]
-
-    # Normalize the kernel
-    for i in range(size):
-        for j in range(size):
-            kernel[i][j] /= sum_val
-
-    return kernel
-
-def apply_gaussian(image, kernel) -> list:
-    """Applies a Gaussian filter to the image using the provided kernel."""
-    height = len(image)
-    width = len(image[0]) if height > 0 else 0
-    kernel_size = len(kernel)
-    pad = kernel_size // 2
-    new_image = []
-
-    # Pad the image with zeros
-    padded_image = [[0] * (width + 2 * pad) for _ in range(height + 2 * pad)]
-    for i in range(height):
-        for j in range(width):
-            padded_image[i + pad][j + pad] = image[i][j]
+def create_gaussian_kernel(size, sigma=1, separable=False) -> tuple:
+    """
+    Returns the (cached) Gaussian kernel from kernels.gaussian_kernel as
+    nested tuples. With separable=True only the normalized 1D factor is
+    returned, the 2D kernel being its outer product with itself.
+    """
+    return gaussian_kernel(size, sigma, separable)
+
+def separable_factors(kernel, tolerance=1e-9):
+    """
+    Returns (column, row) 1D factors whose outer product is the 2D kernel,
+    or None when the kernel is not separable (rank > 1).
+    """
+    # Pivot on the largest coefficient to keep the division well conditioned
+    pivot_row, pivot_col = max(
+        ((i, j) for i in range(len(kernel)) for j in range(len(kernel[0]))),
+        key=lambda ij: abs(kernel[ij[0]][ij[1]])
+    )
+    pivot = kernel[pivot_row][pivot_col]
+    if pivot == 0:
+        return None
+
+    column = [row[pivot_col] for row in kernel]
+    row = [value / pivot for value in kernel[pivot_row]]
+    scale = abs(pivot) * tolerance
+    for i, kernel_row in enumerate(kernel):
+        for j, value in enumerate(kernel_row):
+            if abs(column[i] * row[j] - value) > scale:
+                return None
+    return column, row
+
+def _apply_separable(image:FlatImage, column, row) -> FlatImage:
+    """
+    Runs a horizontal then a vertical 1D pass (2k instead of k*k products per pixel).
+    Horizontal results are kept in a ring of len(column) float rows, so the
+    intermediate never takes more than a kernel's height of rows.
+    """
+    width, height, channels, data = image.width, image.height, image.channels, image.data
+    row_len = width * channels
+    pad_col, pad_row = len(column) // 2, len(row) // 2
+    ring_size = len(column)
+    ring = [array('d', bytes(8 * row_len)) for _ in range(ring_size)]
+    out = bytearray(row_len * height)
+    next_row = 0
 
     for i in range(height):
-        new_row = []
-        for j in range(width):
-            total = 0
-            for dx in range(-pad, pad + 1):
-                for dy in range(-pad, pad + 1):
-                    x = i + pad + dx
-                    y = j + pad + dy
-                    pixel = padded_image[x][y]
-                    total += pixel * kernel[dx + pad][dy + pad]
+        # Horizontal pass for every source row the vertical pass of row i needs;
+        # neighbouring samples of a channel are `channels` bytes apart
+        while next_row < height and next_row <= i + pad_col:
+            dest = ring[next_row % ring_size]
+            base = next_row * row_len - pad_row * channels
+            for j in range(width):
+                n_lo = pad_row - j if j < pad_row else 0
+                n_hi = min(len(row), width - j + pad_row)
+                for c in range(channels):
+                    start = base + j * channels + c
+                    total = 0.0
+                    for n in range(n_lo, n_hi):
+                        total += data[start + n * channels] * row[n]
+                    dest[j * channels + c] = total
+            next_row += 1
+
+        # Zero padding: only the kernel rows that land inside the image contribute
+        taps = [(ring[(i + m - pad_col) % ring_size], column[m])
+                for m in range(max(0, pad_col - i), min(ring_size, height - i + pad_col))]
+        row_start = i * row_len
+        for k in range(row_len):
+            total = 0.0
+            for source, weight in taps:
+                total += source[k] * weight
             # Clamp to 0-255
-            new_pixel = max(0, min(int(total), 255))
-            new_row.append(new_pixel)
-        new_image.append(new_row)
-    return new_image
+            out[row_start + k] = max(0, min(int(total), 255))
+    return FlatImage(width, height, out, channels)
+
+@traced("python")
+def apply_gaussian(image, kernel) -> FlatImage:
+    """
+    Applies a Gaussian filter to the image (every channel) using the provided kernel.
+    A 1D kernel (see create_gaussian_kernel(separable=True)) or a separable
+    2D kernel is applied as two 1D passes.
+    """
+    with stage("convert"):
+        image = _as_image(image)
+    with stage("compute"):
+        if kernel and not isinstance(kernel[0], (list, tuple)):
+            return _apply_separable(image, kernel, kernel)
+        factors = separable_factors(kernel)
+        if factors is not None:
+            return _apply_separable(image, *factors)
 
-def apply_sobel(image) -> list:
+        width, height, channels, data = image.width, image.height, image.channels, image.data
+        row_len = width * channels
+        kernel_size = len(kernel)
+        pad = kernel_size // 2
+        out = bytearray(row_len * height)
 
+        for i in range(height):
+            # Out-of-image neighbours are zero, so their kernel rows/columns are skipped
+            m_lo, m_hi = max(0, pad - i), min(kernel_size, height - i + pad)
+            for j in range(width):
+                n_lo, n_hi = max(0, pad - j), min(kernel_size, width - j + pad)
+                for c in range(channels):
+                    total = 0
+                    for m in range(m_lo, m_hi):
+                        weights = kernel[m]
+                        base = (i + m - pad) * row_len + (j - pad) * channels + c
+                        for n in range(n_lo, n_hi):
+                            total += data[base + n * channels] * weights[n]
+                    # Clamp to 0-255
+                    out[(i * width + j) * channels + c] = max(0, min(int(total), 255))
+        return FlatImage(width, height, out, channels)
+
+@traced("python")
+def apply_sobel(image, magnitude="exact") -> FlatImage:
     """
     takes an image as a parameter and applies
-    the sobel filter to return a list with the new values
+    the sobel filter to every channel to return a FlatImage with the new values.
+    magnitude is "exact" (truncated sqrt(gx^2 + gy^2)), "l1" (|gx| + |gy|)
+    or "max_min" (max + min / 2, within about 12% of exact)
     """
+    sobel_magnitude_mode(magnitude)
+    with stage("convert"):
+        image = _as_image(image)
+    with stage("compute"):
+        width, height, channels, data = image.width, image.height, image.channels, image.data
+        row_len = width * channels
+        out = bytearray(row_len * height)
+        table = sqrt_table()
+        limit = MAX_SQUARED_MAGNITUDE
+        zero_row = bytes(row_len)
+        # One zero pixel of padding at each end; the next pixel is `channels` samples on
+        edge = [0] * channels
 
-    height = len(image)
-    width = len(image[0]) if height > 0 else 0
-    new_image = []
-    
-    # Adding padding to handle edgees
-    padded_image = [[0] * (width + 2) for _ in range(height + 2)]
-    for i in range(height):
-        for j in range(width):
-            padded_image[i + 1][j + 1] = image[i][j]
+        for i in range(height):
+            row_start = i * row_len
+            up = data[row_start - row_len:row_start] if i > 0 else zero_row
+            mid = data[row_start:row_start + row_len]
+            down = data[row_start + row_len:row_start + 2 * row_len] if i < height - 1 else zero_row
+            # The kernels factor as [1,2,1] x [-1,0,1]: vertical sums and differences
+            # of each column first (zero-padded at both ends), then short horizontal ones
+            smooth = [*edge, *(a + 2 * b + c for a, b, c in zip(up, mid, down)), *edge]
+            diff = [*edge, *(c - a for a, c in zip(up, down)), *edge]
+            grad_x = [right - left for left, right in zip(smooth, smooth[2 * channels:])]
+            grad_y = [a + 2 * b + c for a, b, c in zip(diff, diff[channels:], diff[2 * channels:])]
 
-    for i in range(height):
-        new_row = []
-        for j in range(width):
-            region = [
-                [padded_image[i][j], padded_image[i][j+1], padded_image[i][j+2]],
-                [padded_image[i+1][j], padded_image[i+1][j+1], padded_image[i+1][j+2]],
-                [padded_image[i+2][j], padded_image[i+2][j+1], padded_image[i+2][j+2]]
-            ]
-
-            gradient_x = 0
-            gradient_y = 0
-            for x in range(3):
-                for y in range(3):
-                    gradient_x += region[x][y] * SOBEL_X[x][y]
-                    gradient_y += region[x][y] * SOBEL_Y[x][y]
-
-            magnitude = int(math.sqrt(gradient_x ** 2 + gradient_y**2))
-            magnitude = max(0, min(magnitude, 255))
-            new_row.append(magnitude)
-        new_image.append(new_row)
-
-    return new_image
-
-def apply_median_filter(image, kernel) -> list:
-    """
-    Median filter works by applying the median of the values of the neighbours to a pixel
-    """
-    height = len(image)
-    width = len(image[0]) if height > 0 else 0
-    kernel_size = len(kernel)
-    pad = kernel_size // 2
-    new_image = []
-
-    # Pad the image with zeros
-    padded_image = [[0] * (width + 2 * pad) for _ in range(height + 2 * pad)]
-    for i in range(height):
-        for j in range(width):
-            padded_image[i + pad][j + pad] = image[i][j]
+            if magnitude == "exact":
+                squares = (x * x + y * y for x, y in zip(grad_x, grad_y))
+                values = bytes(table[v] if v <= limit else 255 for v in squares)
+            else:
+                pairs = zip(map(abs, grad_x), map(abs, grad_y))
+                if magnitude == "l1":
+                    sums = (x + y for x, y in pairs)
+                else:
+                    sums = (x + (y >> 1) if x >= y else y + (x >> 1) for x, y in pairs)
+                values = bytes(v if v < 255 else 255 for v in sums)
+            out[row_start:row_start + row_len] = values
 
-    for i in range(height):
-        new_row = []
-        for j in range(width):
-            window = []
-            for dx in range(-pad, pad + 1):
+        return FlatImage(width, height, out, channels)
+
+@traced("python")
+def apply_median_filter(image, kernel) -> FlatImage:
+    """
+    Median filter works by applying the median of the values of the neighbours to a pixel.
+    Uses a sliding 256-bin histogram (Huang's algorithm) instead of sorting every
+    window, once per channel; neighbours outside the image count as zeros.
+    """
+    with stage("convert"):
+        image = _as_image(image)
+    with stage("compute"):
+        width, height, channels, data = image.width, image.height, image.channels, image.data
+        row_len = width * channels
+        pad = len(kernel) // 2
+        # The window always spans pad pixels on each side
+        kernel_size = 2 * pad + 1
+        rank = (kernel_size * kernel_size) // 2
+        out = bytearray(row_len * height)
+        histogram = [0] * 256
+
+        for i in range(height):
+            missing_rows = kernel_size - sum(1 for dx in range(-pad, pad + 1) if 0 <= i + dx < height)
+            for c in range(channels):
+                # Sample c of column x in a window row starting at base is data[base + x * channels]
+                rows = [(i + dx) * row_len + c for dx in range(-pad, pad + 1) if 0 <= i + dx < height]
+                for b in range(256):
+                    histogram[b] = 0
+
+                # Window of the first pixel in the row
                 for dy in range(-pad, pad + 1):
-                    x = i + pad + dx
-                    y = j + pad + dy
-                    window.append(padded_image[x][y])
-            
-            # Find median value
-            median = sorted(window)[len(window) // 2]
-            new_row.append(median)
-        new_image.append(new_row)
-    
-    return new_image
\ No newline at end of file
+                    if 0 <= dy < width:
+                        for base in rows:
+                            histogram[data[base + dy * channels]] += 1
+                    else:
+                        histogram[0] += len(rows)
+                histogram[0] += missing_rows * kernel_size
+
+                # Median and count of values below it, kept up to date while sliding
+                median, below = 0, 0
+                while below + histogram[median] <= rank:
+                    below += histogram[median]
+                    median += 1
+                out[i * row_len + c] = median
+
+                for j in range(1, width):
+                    old_col, new_col = j - pad - 1, j + pad
+                    for base in rows:
+                        value = data[base + old_col * channels] if 0 <= old_col < width else 0
+                        histogram[value] -= 1
+                        if value < median:
+                            below -= 1
+                        value = data[base + new_col * channels] if 0 <= new_col < width else 0
+                        histogram[value] += 1
+                        if value < median:
+                            below += 1
+                    while below > rank:
+                        median -= 1
+                        below -= histogram[median]
+                    while below + histogram[median] <= rank:
+                        below += histogram[median]
+                        median += 1
+                    out[i * row_len + j * channels + c] = median
+
+        return FlatImage(width, height, out, channels)
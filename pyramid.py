@@ -0,0 +1,156 @@
+"""
+Gaussian image pyramids for instant previews and coarse-to-fine filtering.
+
+Level 0 is the image itself and every level above it is the previous one
+blurred with create_gaussian_kernel(PYRAMID_KERNEL_SIZE, PYRAMID_SIGMA)
+and subsampled by 2, so level k has 4^k times fewer pixels. Filtering a
+high level and scaling the result back up gives a preview of the
+full-resolution result for a fraction of the cost:
+
+    edges = filter_at_level(image, "sobel", 2)          # 1/16 of the pixels, full-size result
+    quick = preview(image, "gaussian", size=9, sigma=3)  # level picked from PREVIEW_PIXELS
+    levels = build_pyramid(image, 3)
+    blurred, median = (filter_level(levels, 3, name) for name in ("gaussian", "median"))
+    for level, result in coarse_to_fine(image, "median", backend="cython"):
+        show(result)                                     # coarsest first, exact at level 0
+
+Filter parameters are given at full resolution and scaled to the level
+(sigma and window sizes shrink by 2 per level). The pyramid blur is
+zero-padded like the filters, with the weights renormalized at the edges
+so the borders of the higher levels do not darken.
+"""
+
+import numpy as np
+from PIL import Image
+
+import backends
+import process_image_numpy
+
+# Burt-Adelson style reduction kernel
+PYRAMID_KERNEL_SIZE = 5
+PYRAMID_SIGMA = 1.0
+# Pixels a preview level holds at most
+PREVIEW_PIXELS = 256 * 256
+
+
+def _edge_weights(length: int, kernel: np.ndarray) -> np.ndarray:
+    """Sum of the kernel taps that fall inside a line of `length` pixels, per pixel."""
+    center = len(kernel) // 2
+    return np.convolve(np.ones(length), kernel)[center:center + length]
+
+
+def _decimate(image: np.ndarray, kernel: np.ndarray, axis: int) -> np.ndarray:
+    """Blurs a float32 image along one axis and keeps every other sample, computing only those."""
+    length = image.shape[axis]
+    center, kept = len(kernel) // 2, (length + 1) // 2
+    lines = np.moveaxis(image, axis, 0)
+    padded = np.zeros((length + 2 * center,) + lines.shape[1:], dtype=np.float32)
+    padded[center:center + length] = lines
+    result = kernel[0] * padded[0:2 * kept - 1:2]
+    for k in range(1, len(kernel)):
+        result += kernel[k] * padded[k:k + 2 * kept - 1:2]
+    result /= _edge_weights(length, kernel)[::2].astype(np.float32).reshape((kept,) + (1,) * (image.ndim - 1))
+    return np.moveaxis(result, 0, axis)
+
+
+def reduce(image: np.ndarray) -> np.ndarray:
+    """One pyramid step: the uint8 H x W (x C) image blurred and subsampled to ceil(H / 2) x ceil(W / 2)."""
+    # float32 taps: float64 ones would promote every product to float64
+    kernel = process_image_numpy.create_gaussian_kernel(PYRAMID_KERNEL_SIZE, PYRAMID_SIGMA,
+                                                        separable=True).astype(np.float32)
+    work = image.astype(np.float32)
+    for axis in (0, 1):
+        work = _decimate(work, kernel, axis)
+    return np.clip(np.rint(work), 0, 255).astype(np.uint8)
+
+
+def build_pyramid(image: np.ndarray, levels: int) -> list:
+    """[image, level 1, ..., level `levels`], stopping early once a level is 1 pixel high or wide."""
+    image = np.asarray(image)
+    if image.dtype != np.uint8:
+        image = np.clip(image, 0, 255).astype(np.uint8)
+    pyramid = [image]
+    while len(pyramid) <= levels and min(pyramid[-1].shape[:2]) > 1:
+        pyramid.append(reduce(pyramid[-1]))
+    return pyramid
+
+
+def level_for(shape: tuple, max_pixels: int = PREVIEW_PIXELS) -> int:
+    """The lowest level of an image of this shape with at most max_pixels pixels."""
+    height, width = shape[:2]
+    level = 0
+    while height * width > max_pixels and min(height, width) > 1:
+        height, width = (height + 1) // 2, (width + 1) // 2
+        level += 1
+    return level
+
+
+def scale_params(filter_name: str, params: dict, level: int) -> dict:
+    """Full-resolution filter parameters scaled to a pyramid level (sizes stay odd)."""
+    params = dict(params)
+    factor = 2 ** level
+    if filter_name == "gaussian":
+        params["sigma"] = params.get("sigma", 3) / factor
+        params["size"] = max(int(params.get("size", 9) / factor), 1) | 1
+    elif filter_name == "median":
+        params["size"] = max(int(params.get("size", 3) / factor), 1) | 1
+    return params
+
+
+def upsample(image: np.ndarray, shape: tuple) -> np.ndarray:
+    """Bilinear resize of a uint8 H x W (x C) array to shape[:2]."""
+    if image.shape[:2] == tuple(shape[:2]):
+        return image
+    height, width = shape[:2]
+    return np.asarray(Image.fromarray(image).resize((width, height), Image.Resampling.BILINEAR))
+
+
+def filter_level(pyramid: list, level: int, filter_name: str, backend: str = "numpy",
+                 output_shape: tuple = None, **params) -> np.ndarray:
+    """
+    Runs a filter on level `level` of a pyramid from build_pyramid, with
+    full-resolution params scaled to the level, and returns the result
+    upsampled to output_shape (the shape of level 0 by default). Several
+    filters can share one pyramid this way.
+    """
+    params = scale_params(filter_name, params, level)
+    coarse = pyramid[level]
+    if filter_name == "median" and params["size"] == 1:
+        # A 1-pixel median leaves the level unchanged
+        result = coarse
+    else:
+        result = backends.apply(filter_name, coarse, backend, **params)
+    return upsample(result, pyramid[0].shape if output_shape is None else output_shape)
+
+
+def filter_at_level(image: np.ndarray, filter_name: str, level: int, backend: str = "numpy",
+                    output_shape: tuple = None, **params) -> np.ndarray:
+    """
+    Runs "sobel", "gaussian" or "median" (see backends.apply) on pyramid
+    level `level` with params scaled to it and returns the result upsampled
+    to output_shape (the image's shape by default). Level 0 is the exact
+    full-resolution filter.
+    """
+    pyramid = build_pyramid(image, level)
+    return filter_level(pyramid, len(pyramid) - 1, filter_name, backend, output_shape, **params)
+
+
+def preview(image: np.ndarray, filter_name: str, backend: str = "numpy", max_pixels: int = PREVIEW_PIXELS,
+            output_shape: tuple = None, **params) -> np.ndarray:
+    """filter_at_level on the lowest level holding at most max_pixels pixels."""
+    return filter_at_level(image, filter_name, level_for(np.shape(image), max_pixels), backend,
+                           output_shape, **params)
+
+
+def coarse_to_fine(image: np.ndarray, filter_name: str, backend: str = "numpy", levels: int = None,
+                   **params):
+    """
+    Yields (level, full-size result) from level `levels` (by default the
+    preview level) down to the exact result at level 0, building the
+    pyramid once.
+    """
+    if levels is None:
+        levels = level_for(np.shape(image))
+    pyramid = build_pyramid(image, levels)
+    for level in range(len(pyramid) - 1, -1, -1):
+        yield level, filter_level(pyramid, level, filter_name, backend, **params)
@@ -0,0 +1,138 @@
+"""
+Content-addressed cache of filtered images and their timings.
+
+Results are keyed by a hash of the image pixels plus backend, filter and
+filter parameters, the file the backend module loads from (its source, or
+the compiled extension) and CACHE_VERSION, so changing a filter
+implementation invalidates its stored results. Lookups go to an in-memory LRU tier first, then to an
+on-disk tier of .npz files that is trimmed back to a byte budget by
+evicting the least recently used entries.
+"""
+
+import hashlib
+import importlib.util
+import json
+import os
+import pathlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+
+CACHE_DIR = pathlib.Path(".cache") / "results"
+MEMORY_ENTRIES = 64
+DISK_BYTES = 512 * 1024 * 1024
+# Part of every key: bump it when the stored entries change meaning or format
+CACHE_VERSION = 1
+
+
+def image_digest(image) -> str:
+    """SHA-256 of a PIL image's mode, size and pixel bytes."""
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def module_version(module_name: str) -> str:
+    """SHA-256 of the file a module loads from, without importing it ('' if there is none)."""
+    spec = importlib.util.find_spec(module_name)
+    origin = spec.origin if spec is not None else None
+    if not origin or not os.path.isfile(origin):
+        return ""
+    return hashlib.sha256(pathlib.Path(origin).read_bytes()).hexdigest()
+
+
+def cache_key(digest: str, backend: str, filter_name: str, params: dict = None, version: str = "") -> str:
+    """Key of one filter result for an image digest; version identifies the backend code (see module_version)."""
+    payload = json.dumps([CACHE_VERSION, version, digest, backend, filter_name, params or {}], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResultCache:
+    """Two-tier (memory LRU + size-bounded disk) store of (image, seconds) results."""
+
+    def __init__(self, directory=CACHE_DIR, memory_entries: int = MEMORY_ENTRIES,
+                 disk_bytes: int = DISK_BYTES):
+        self.directory = pathlib.Path(directory) if directory else None
+        self.memory_entries = memory_entries
+        self.disk_bytes = disk_bytes
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.directory:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.directory / f"{key}.npz"
+
+    def get(self, key: str):
+        """Returns (image, seconds) for key, or None on a miss."""
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key]
+        if self.directory:
+            path = self._path(key)
+            try:
+                with np.load(path) as stored:
+                    entry = (stored["image"], float(stored["seconds"]))
+                os.utime(path)  # mark as recently used for eviction
+            except (OSError, KeyError, ValueError):
+                entry = None
+            if entry is not None:
+                self._remember(key, entry)
+                with self.lock:
+                    self.hits += 1
+                return entry
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, image: np.ndarray, seconds: float) -> None:
+        """Stores a result in both tiers."""
+        entry = (image, seconds)
+        self._remember(key, entry)
+        if not self.directory:
+            return
+        # Write to a temporary name first so readers never see a partial file
+        tmp_path = self.directory / f"{key}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez(tmp_path, image=image, seconds=seconds)
+        os.replace(tmp_path, self._path(key))
+        self._evict_disk()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.memory.clear()
+        if self.directory:
+            for path in self.directory.glob("*.npz"):
+                path.unlink(missing_ok=True)
+
+    def _remember(self, key: str, entry) -> None:
+        with self.lock:
+            self.memory[key] = entry
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_entries:
+                self.memory.popitem(last=False)
+
+    def _evict_disk(self) -> None:
+        """Deletes least recently used files until the directory fits the byte budget."""
+        entries = []
+        for path in self.directory.glob("*.npz"):
+            if path.name.endswith(".tmp.npz"):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.disk_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
@@ -1,10 +1,28 @@
-from setuptools import setup
+import sys
+from setuptools import Extension, setup
 from Cython.Build import cythonize
 import numpy
 
+# OpenMP flags for the prange loops; without them the filters still build and run single-threaded
+if sys.platform == "win32":
+    openmp_compile_args, openmp_link_args = ["/openmp"], []
+elif sys.platform == "darwin":
+    openmp_compile_args, openmp_link_args = [], []  # Apple clang ships without libomp
+else:
+    openmp_compile_args, openmp_link_args = ["-fopenmp"], ["-fopenmp"]
+
+extensions = [
+    Extension(
+        "process_image_cython",
+        ["process_image_cython.pyx"],
+        extra_compile_args=openmp_compile_args,
+        extra_link_args=openmp_link_args,
+    )
+]
+
 setup(
-    ext_modules=cythonize("process_image_cython.pyx"),
+    ext_modules=cythonize(extensions),
     include_dirs=[numpy.get_include()]
     )
 
-### python setup.py build_ext --inplace
\ No newline at end of file
+### python setup.py build_ext --inplace
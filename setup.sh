@@ -1,2 +1,8 @@
 #!/bin/bash
-pip install --no-cache-dir Pillow
\ No newline at end of file
+# Build step: install the dependencies, compile the Cython backend and check
+# that everything imports, once here instead of on every start of the app.
+set -e
+pip install --no-cache-dir -r requirements.txt
+python setup.py build_ext --inplace
+python -c "import PIL, numpy, scipy.ndimage, pandas, streamlit, streamlit_echarts"
+python -c "import backends, sys; missing = backends.unavailable(); print(missing or 'all backends available'); sys.exit(1 if 'numpy' in missing else 0)"
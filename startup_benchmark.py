@@ -0,0 +1,100 @@
+"""
+Cold-start benchmark: import time and first-request latency of each backend.
+
+Every measurement runs in a fresh interpreter, as a new app process or
+worker would. The probe imports the backend, optionally waits for
+backends.warm_up, then serves two "requests" (Sobel, Gaussian and median
+on one image). The report gives, per backend and mode:
+
+    import       numpy + backends + the backend module
+    warm-up      backends.warm_up (0 in cold mode)
+    1st request  the first request (lazy imports, caches, first-touch memory)
+    2nd request  the same request again, for reference
+    to response  process start to the end of the first request
+
+    python startup_benchmark.py --size 512 --repeats 5
+"""
+
+import argparse
+import json
+import pathlib
+import statistics
+import subprocess
+import sys
+import time
+
+import backends
+
+# Runs in the child interpreter; argv: backend name, image side, warm-up flag
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import numpy as np
+import backends
+name, size, warm = sys.argv[1], int(sys.argv[2]), sys.argv[3] == "1"
+adapter = backends.get_backend(name)
+imported = time.perf_counter()
+if warm:
+    backends.warm_up_in_background([name]).join()
+ready = time.perf_counter()
+image = np.random.default_rng(0).integers(0, 256, (size, size), dtype=np.uint8)
+
+def request():
+    began = time.perf_counter()
+    for filter_name in backends.FILTERS:
+        getattr(adapter, filter_name)(image)
+    return time.perf_counter() - began
+
+first = request()
+responded = time.time()
+second = request()
+print(json.dumps({"import": imported - start, "warm_up": ready - imported,
+                  "first": first, "second": second, "responded": responded}))
+"""
+
+COLUMNS = [("import", "import"), ("warm_up", "warm-up"), ("first", "1st request"),
+           ("second", "2nd request"), ("to_response", "to response")]
+
+
+def probe(name: str, size: int, warm: bool) -> dict:
+    """One fresh-interpreter measurement, in seconds."""
+    launched = time.time()
+    output = subprocess.run([sys.executable, "-c", _PROBE, name, str(size), "1" if warm else "0"],
+                            capture_output=True, text=True, check=True,
+                            cwd=pathlib.Path(__file__).resolve().parent).stdout
+    timings = json.loads(output.strip().splitlines()[-1])
+    timings["to_response"] = timings.pop("responded") - launched
+    return timings
+
+
+def run(names: list = None, size: int = 256, repeats: int = 3) -> list:
+    """Median timings of every (backend, cold / warm-up) pair."""
+    rows = []
+    for name in names or backends.available():
+        for warm in (False, True):
+            samples = [probe(name, size, warm) for _ in range(repeats)]
+            row = {"backend": name, "mode": "warm-up" if warm else "cold"}
+            row.update({key: statistics.median(s[key] for s in samples) for key, _ in COLUMNS})
+            rows.append(row)
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import time and first-request latency of the backends.")
+    parser.add_argument("--backends", nargs="+", choices=list(backends.BACKEND_MODULES), default=None)
+    parser.add_argument("--size", type=int, default=256, help="side of the request image")
+    parser.add_argument("--repeats", type=int, default=3, help="fresh interpreters per measurement")
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    args = parser.parse_args()
+
+    rows = run(args.backends, args.size, args.repeats)
+    print(f"{'backend':<8} {'mode':<8}" + "".join(f"{label:>13}" for _, label in COLUMNS))
+    for row in rows:
+        print(f"{row['backend']:<8} {row['mode']:<8}"
+              + "".join(f"{row[key] * 1000:>10.1f} ms" for key, _ in COLUMNS))
+    if args.json_path:
+        pathlib.Path(args.json_path).write_text(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
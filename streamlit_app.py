@@ -1,70 +1,56 @@
-import os
-import subprocess
+import numpy as np
 import pandas as pd
-import time, math
 from PIL import Image
 import streamlit as st
 from streamlit_echarts import st_echarts
-import sys
-
-# Reinstalando paquetes
-os.system("pip install -r requirements.txt")
-
-# Lista de nombres de carpetas
-folders = ['python_dir', 'cython_dir', 'numpy_dir']
-
-# Crear cada carpeta si no existe
-for folder in folders:
-    if not os.path.exists(folder):
-        os.makedirs(folder)
-        print(f"Carpeta '{folder}' creada.")
-    else:
-        print(f"Carpeta '{folder}' ya existe.")
-
-
-def check_installed(package):
-    try:
-        subprocess.run(["pip", "show", package], check=True, capture_output=True)
-        return True
-    except subprocess.CalledProcessError:
-        return False
-
-if not check_installed("Pillow"):
-    print("⚠️ Pillow NO está instalado en el entorno de Streamlit Cloud.")
-
-import PIL  # Esto fallará si no está instalado
-print("✅ Pillow está instalado correctamente.")
-
-def apply_filter(image, script_name):
-    """Ejecuta un script externo y mide su tiempo de ejecución."""
-    
-    # Guardar la imagen temporalmente
-    image.save("image.jpg")
-
-    # Medir el tiempo de ejecución
-    start_time = time.time()
-    
-    try:
-        subprocess.run(["python", script_name], check=True)
-    except subprocess.CalledProcessError as e:
-        raise RuntimeError(f"Error al ejecutar {script_name}: {e}")
-
-    return time.time() - start_time  # Retorna el tiempo de ejecución
-
-def read_metrics_csv(csv_path):
-    """Lee el CSV de métricas y devuelve un DataFrame formateado correctamente."""
-    if not os.path.exists(csv_path):
-        raise FileNotFoundError(f"No se encontró el archivo de métricas '{csv_path}'.")
-    
-    df = pd.read_csv(csv_path)
-
-    # Renombrar columnas para facilitar el manejo
-    df.rename(columns={"Filter Type": "Filter", "Implementation": "Method", "Processing Time (seconds)": "Time"}, inplace=True)
-
-    # Transformar la tabla para que tenga columnas separadas para Python y Numpy
-    metrics_pivot = df.pivot(index="Filter", columns="Method", values="Time").reset_index()
-
-    return metrics_pivot  # Devuelve el DataFrame con la estructura correcta
+import backends
+from benchmark import FILTER_NAMES, FILTER_PARAMS, run_benchmark, timings_by_filter, to_grayscale
+from image_io import fit_size
+from pyramid import build_pyramid, filter_level, level_for
+from result_cache import ResultCache
+
+# Las dependencias se instalan y comprueban al construir la imagen (setup.sh),
+# no en cada arranque de la app
+
+@st.cache_resource
+def start_warm_up():
+    """Calienta los backends en segundo plano una sola vez por proceso (imports perezosos, kernels)."""
+    return backends.warm_up_in_background()
+
+start_warm_up()
+
+@st.cache_resource
+def get_result_cache():
+    """Caché de resultados compartida entre sesiones (memoria + disco)."""
+    return ResultCache()
+
+# Nombre del filtro en el benchmark -> nombre en backends / pyramid
+PREVIEW_FILTERS = {"Sobel": "sobel", "Gaussian": "gaussian", "Median Noise-reduction": "median"}
+# Lado máximo de las imágenes de la vista previa (el navegador las escala)
+PREVIEW_SIDE = 512
+
+def show_preview(image):
+    """Muestra al instante los filtros a baja resolución (pirámide gaussiana) y devuelve su contenedor."""
+    slot = st.empty()
+    gray = np.asarray(to_grayscale(image))
+    width, height = fit_size((gray.shape[1], gray.shape[0]), PREVIEW_SIDE)
+    # Una sola pirámide para los tres filtros
+    pyramid = build_pyramid(gray, level_for(gray.shape))
+    with slot.container():
+        st.write("### Preview")
+        st.caption("Low-resolution preview; the full-resolution benchmark is running...")
+        for col, filter_name in zip(st.columns(len(FILTER_NAMES)), FILTER_NAMES):
+            with col:
+                st.image(filter_level(pyramid, len(pyramid) - 1, PREVIEW_FILTERS[filter_name],
+                                      output_shape=(height, width), **FILTER_PARAMS[filter_name]),
+                         caption=filter_name, use_container_width=True)
+    return slot
+
+def build_metrics_df(results):
+    """Convierte los resultados del benchmark en un DataFrame con una columna por backend."""
+    timings = timings_by_filter(results)
+    rows = [{"Filter": filter_name, **row} for filter_name, row in timings.items()]
+    return pd.DataFrame(rows)
 
 # ---- INTERFAZ EN STREAMLIT ----
 st.title("High Performance Computing")
@@ -93,28 +79,21 @@ if image:
 
     if st.button("Apply Filter"):
         try:
-            metrics_file = "metrics/values.csv"
-
-            # Borrar archivo de métricas si existe
-            if os.path.exists(metrics_file):
-                os.remove(metrics_file)
-
-            # Aplicar filtros con Python y Numpy
-            time_python = apply_filter(image, "unit_test.py")
-            time_numpy = apply_filter(image, "unit_test_numpy.py")
-            time_cython = apply_filter(image, "unit_test_cython.py")
-
-            # Leer métricas desde el CSV
-            metrics_df = read_metrics_csv(metrics_file)
+            # Vista previa inmediata mientras se calcula la resolución completa
+            preview_slot = show_preview(image)
+            # Aplicar los filtros en memoria con Python, Numpy y Cython
+            results = run_benchmark(image, cache=get_result_cache())
+            preview_slot.empty()
+            if all(result.cached for result in results):
+                st.info("Resultados recuperados de la caché para esta imagen.")
+            metrics_df = build_metrics_df(results)
+            backend_names = [name for name in ("Python", "Numpy", "Cython") if name in metrics_df.columns]
 
             # Verificar que las columnas sean correctas
             if "Python" not in metrics_df.columns or "Numpy" not in metrics_df.columns:
                 st.error(f"Error: No se encontraron las columnas 'Python' o 'Numpy'. Columnas actuales: {list(metrics_df.columns)}")
             else:
                # ---- PERFORMANCE ----
-                # Read execution time metrics
-                metrics_df = read_metrics_csv("metrics/values.csv")
-
                 st.header('Speedup Analysis', divider='gray')
 
                 # Crear columnas para mostrar las métricas
@@ -125,42 +104,31 @@ if image:
 
                     with col:
                         python_time = metrics_df[metrics_df["Filter"] == filter_name]["Python"].iat[0]
-                        numpy_time = metrics_df[metrics_df["Filter"] == filter_name]["Numpy"].iat[0]
-                        cython_time = metrics_df[metrics_df["Filter"] == filter_name]["Cython"].iat[0]
-
-                        # Calcular Speedup (manejando división por cero)
-                        speedup_numpy = python_time / numpy_time if numpy_time > 0 else float('inf')
-                        speedup_cython = python_time / cython_time if cython_time > 0 else float('inf')
-
-                        # Determinar color verde cuando NumPy o Cython son más rápidos
-                        delta_color_numpy = "normal" if speedup_numpy > 1 else "inverse"
-                        delta_color_cython = "normal" if speedup_cython > 1 else "inverse"
 
                         # Mostrar ejecución de Python
                         st.metric(label=f'Python ({filter_name})', value=f'{python_time:.4f}s')
 
-                        # Mostrar ejecución de NumPy con Speedup en verde
-                        st.metric(
-                            label=f'NumPy ({filter_name})',
-                            value=f'{numpy_time:.4f}s',
-                            delta=f'{speedup_numpy:,.2f}x',
-                            delta_color=delta_color_numpy
-                        )
-
-                        # Mostrar ejecución de Cython con Speedup en verde
-                        st.metric(
-                            label=f'Cython ({filter_name})',
-                            value=f'{cython_time:.4f}s',
-                            delta=f'{speedup_cython:,.2f}x',
-                            delta_color=delta_color_cython
-                        )
+                        for backend in backend_names[1:]:
+                            backend_time = metrics_df[metrics_df["Filter"] == filter_name][backend].iat[0]
+
+                            # Calcular Speedup (manejando división por cero)
+                            speedup = python_time / backend_time if backend_time > 0 else float('inf')
+
+                            # Mostrar ejecución con Speedup en verde cuando es más rápido que Python
+                            st.metric(
+                                label=f'{"NumPy" if backend == "Numpy" else backend} ({filter_name})',
+                                value=f'{backend_time:.4f}s',
+                                delta=f'{speedup:,.2f}x',
+                                delta_color="normal" if speedup > 1 else "inverse"
+                            )
 
                 # ---- GRAFICAR TIEMPOS ----
                 st.header("Execution Time Comparison", divider='gray')
 
+                colors = {"Python": "red", "Numpy": "blue", "Cython": "green"}
                 option = {
                     "tooltip": {"trigger": "axis"},
-                    "legend": {"data": ["Python", "Numpy", "Cython"]},
+                    "legend": {"data": backend_names},
                     "xAxis": {
                         "type": "category",
                         "data": metrics_df["Filter"].tolist(),  # Nombres de los filtros
@@ -168,23 +136,12 @@ if image:
                     "yAxis": {"type": "value", "name": "Time (seconds)"},
                     "series": [
                         {
-                            "name": "Python",
-                            "data": metrics_df["Python"].tolist(),  # Tiempos de Python
+                            "name": backend,
+                            "data": metrics_df[backend].tolist(),  # Tiempos de cada backend
                             "type": "bar",
-                            "color": "red",
-                        },
-                        {
-                            "name": "Numpy",
-                            "data": metrics_df["Numpy"].tolist(),  # Tiempos de Numpy
-                            "type": "bar",
-                            "color": "blue",
-                        },
-                        {
-                            "name": "Cython",
-                            "data": metrics_df["Cython"].tolist(),  # Tiempos de Cython
-                            "type": "bar",
-                            "color": "green",
+                            "color": colors[backend],
                         }
+                        for backend in backend_names
                     ],
                 }
 
@@ -194,60 +151,30 @@ if image:
                 # ---- GRAFICAR IMAGENES EN TABLA ----
                 print('Printing the image results...')
 
-                # Lista de filtros utilizados
-                filters = ["Sobel", "Gaussian", "Noise_reduction"]
-
                 # Mostrar título
                 st.write("### Filter Results")
 
                 # Crear tabla con imágenes en Streamlit
-                col1, col2, col3, col4 = st.columns(4)
+                header = st.columns(len(backend_names) + 1)
 
-                with col1:
+                with header[0]:
                     st.write("**Filter**")
 
-                with col2:
-                    st.write("**Python**")
-
-                with col3:
-                    st.write("**Numpy**")
-
-                with col4:
-                    st.write("**Cython**")
+                for col, backend in zip(header[1:], backend_names):
+                    with col:
+                        st.write(f"**{backend}**")
 
-                for filter_name in filters:
-                    python_img = os.path.join(f"python_dir", f"{filter_name}.jpg")
-                    numpy_img = os.path.join(f"numpy_dir", f"{filter_name}.jpg")
-                    cython_img = os.path.join(f"cython_dir", f"{filter_name}.jpg")
+                outputs = {(result.filter, result.backend): result.image for result in results}
 
-                    col1, col2, col3, col4 = st.columns(4)
+                for filter_name in metrics_df["Filter"]:
+                    row = st.columns(len(backend_names) + 1)
 
-                    with col1:
+                    with row[0]:
                         st.write(f"**{filter_name}**")
 
-                    with col2:
-                        if os.path.exists(python_img):
-                            st.image(python_img, caption="Python", use_container_width=True)
-                        else:
-                            st.write("❌ No Image")
-
-                    with col3:
-                        if os.path.exists(numpy_img):
-                            st.image(numpy_img, caption="Numpy", use_container_width=True)
-                        else:
-                            st.write("❌ No Image")
-
-                    with col4:
-                        if os.path.exists(cython_img):
-                            st.image(cython_img, caption="Cython", use_container_width=True)
-                        else:
-                            st.write("❌ No Image")
-
-
-                
-
-                
-
+                    for col, backend in zip(row[1:], backend_names):
+                        with col:
+                            st.image(outputs[(filter_name, backend)], caption=backend, use_container_width=True)
 
         except Exception as e:
             st.error(f"Error: {e}")
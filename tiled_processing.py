@@ -0,0 +1,205 @@
+"""
+Tiled, memory-bounded filtering of images too large to hold in memory.
+
+The image is read tile by tile with a halo of kernel-radius pixels around
+each tile, filtered with one of the existing backends and streamed to
+disk, so peak memory depends on the tile size rather than the image size.
+"""
+
+import argparse
+import pathlib
+
+import numpy as np
+from PIL import Image
+
+import process_image_numpy
+from kernels import GAUSSIAN_MODES, SOBEL_MAGNITUDES, gaussian_halo
+
+# Netpbm grayscale header written for .pgm outputs
+PGM_HEADER = "P5\n{width} {height}\n255\n"
+
+
+def _gaussian(backend, image, size=9, sigma=3, mode="exact"):
+    return backend.apply_gaussian(image, size, sigma, mode)
+
+def _median(backend, image, size=3):
+    return backend.apply_median_filter(image, size)
+
+def _sobel(backend, image, magnitude="exact"):
+    return backend.apply_sobel(image, magnitude=magnitude)
+
+# Filter name -> (halo in pixels for the given params, function applying it)
+FILTERS = {
+    "sobel": (lambda magnitude="exact": 1, _sobel),
+    "gaussian": (gaussian_halo, _gaussian),
+    "median": (lambda size=3: size // 2, _median),
+}
+
+
+def filter_halo(filter_name: str, **params) -> int:
+    """Number of neighbouring pixels the filter reads on each side of a pixel."""
+    if filter_name not in FILTERS:
+        raise ValueError(f"unknown filter '{filter_name}', expected one of {sorted(FILTERS)}")
+    halo, _ = FILTERS[filter_name]
+    return halo(**params)
+
+
+def iter_tiles(height: int, width: int, tile_rows: int, tile_cols: int, halo: int):
+    """
+    Yields (output, source, inner) slice pairs covering the image:
+    output is the tile in image coordinates, source the tile grown by the
+    halo and clipped to the image, and inner locates the tile inside source.
+
+    Because source is only clipped at the image borders, a filter run on
+    source with its own border mode gives exactly the whole-image result
+    inside inner.
+    """
+    for top in range(0, height, tile_rows):
+        bottom = min(top + tile_rows, height)
+        src_top, src_bottom = max(top - halo, 0), min(bottom + halo, height)
+        for left in range(0, width, tile_cols):
+            right = min(left + tile_cols, width)
+            src_left, src_right = max(left - halo, 0), min(right + halo, width)
+            yield (
+                (slice(top, bottom), slice(left, right)),
+                (slice(src_top, src_bottom), slice(src_left, src_right)),
+                (slice(top - src_top, bottom - src_top), slice(left - src_left, right - src_left)),
+            )
+
+
+def _read_pgm_header(path: str):
+    """Returns (width, height, data offset) of a binary 8-bit PGM file, or None."""
+    with open(path, "rb") as file:
+        head = file.read(512)
+    if not head.startswith(b"P5"):
+        return None
+    fields, pos = [], 2
+    while len(fields) < 3:
+        while head[pos:pos + 1].isspace():
+            pos += 1
+        if head[pos:pos + 1] == b"#":
+            pos = head.index(b"\n", pos)
+            continue
+        end = pos
+        while not head[end:end + 1].isspace():
+            end += 1
+        fields.append(int(head[pos:end]))
+        pos = end
+    width, height, maxval = fields
+    if maxval > 255:
+        return None
+    return width, height, pos + 1
+
+
+def open_image_source(path: str) -> np.ndarray:
+    """
+    Opens an image as a 2D uint8 array without loading it all where possible.
+
+    .npy files and binary PGM files are memory-mapped, so only the tiles
+    being filtered are paged in. Other formats (JPEG, PNG, ...) cannot be
+    decoded piecewise by PIL and are decoded once into a uint8 array,
+    1 byte per pixel.
+    """
+    suffix = pathlib.Path(path).suffix.lower()
+    if suffix == ".npy":
+        image = np.load(path, mmap_mode="r")
+        if image.ndim != 2 or image.dtype != np.uint8:
+            raise ValueError(f"{path}: expected a 2D uint8 array, got {image.dtype} {image.shape}")
+        return image
+    if suffix == ".pgm":
+        header = _read_pgm_header(path)
+        if header is not None:
+            width, height, offset = header
+            return np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=(height, width))
+    return np.asarray(Image.open(path).convert('L'))
+
+
+class _PGMStripWriter:
+    """Streams full-width row strips to a binary PGM file."""
+
+    def __init__(self, path: str, height: int, width: int):
+        self.file = open(path, "wb")
+        self.file.write(PGM_HEADER.format(width=width, height=height).encode("ascii"))
+
+    def write(self, rows: np.ndarray) -> None:
+        self.file.write(np.ascontiguousarray(rows, dtype=np.uint8).tobytes())
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def filter_tiled(source_path: str, output_path: str, filter_name: str,
+                 tile_rows: int = 512, tile_cols: int = None, backend=process_image_numpy,
+                 **params) -> None:
+    """
+    Applies a filter tile by tile and streams the result to output_path.
+
+    output_path must be a .npy file (written through a memory map) or a
+    .pgm file (written strip by strip). tile_cols=None uses full-width
+    strips. backend is process_image_numpy or process_image_cython; params
+    are passed to the filter (size/sigma/mode for gaussian, size for median).
+    The result is identical to filtering the whole image at once.
+    """
+    halo = filter_halo(filter_name, **params)
+    _, apply = FILTERS[filter_name]
+    source = open_image_source(source_path)
+    height, width = source.shape
+    tile_cols = tile_cols or width
+
+    suffix = pathlib.Path(output_path).suffix.lower()
+    if suffix == ".npy":
+        output = np.lib.format.open_memmap(output_path, mode="w+", dtype=np.uint8, shape=(height, width))
+        writer = None
+    elif suffix == ".pgm":
+        output = None
+        writer = _PGMStripWriter(output_path, height, width)
+        strip = np.empty((min(tile_rows, height), width), dtype=np.uint8)
+    else:
+        raise ValueError(f"unsupported output format '{suffix}', use .npy or .pgm")
+
+    try:
+        for out_slice, src_slice, inner in iter_tiles(height, width, tile_rows, tile_cols, halo):
+            # uint8 tiles go straight to the backend, which returns uint8
+            result = apply(backend, source[src_slice], **params)[inner]
+            if output is not None:
+                output[out_slice] = result
+                continue
+            rows, cols = out_slice
+            strip[:rows.stop - rows.start, cols] = result
+            if cols.stop == width:
+                writer.write(strip[:rows.stop - rows.start])
+    finally:
+        if writer is not None:
+            writer.close()
+        if output is not None:
+            output.flush()
+            del output
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Filter a very large image tile by tile.")
+    parser.add_argument("source", help="input image (.npy and binary .pgm are memory-mapped)")
+    parser.add_argument("output", help="output .npy or .pgm file")
+    parser.add_argument("--filter", choices=sorted(FILTERS), default="sobel")
+    parser.add_argument("--size", type=int, help="kernel size for gaussian/median")
+    parser.add_argument("--sigma", type=float, help="sigma for gaussian")
+    parser.add_argument("--mode", choices=GAUSSIAN_MODES, help="exact or box-approximated (fast) gaussian")
+    parser.add_argument("--magnitude", choices=SOBEL_MAGNITUDES, help="gradient magnitude for sobel")
+    parser.add_argument("--tile-rows", type=int, default=512)
+    parser.add_argument("--tile-cols", type=int, default=None)
+    parser.add_argument("--backend", choices=["numpy", "cython"], default="numpy")
+    args = parser.parse_args()
+
+    params = {name: value for name, value in (("size", args.size), ("sigma", args.sigma),
+                                              ("mode", args.mode), ("magnitude", args.magnitude))
+              if value is not None}
+    if args.backend == "cython":
+        import process_image_cython as backend
+    else:
+        backend = process_image_numpy
+    filter_tiled(args.source, args.output, args.filter, args.tile_rows, args.tile_cols, backend, **params)
+    print(f"{args.filter} filter written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -25,8 +25,9 @@ def test_filters():
     csv_dir = pathlib.Path("metrics")
     csv_file = csv_dir / "values.csv"
 
-    # Crear carpeta 'metrics' si no existe
+    # Crear carpetas 'metrics' y de salida si no existen
     csv_dir.mkdir(parents=True, exist_ok=True)
+    pathlib.Path("cython_dir").mkdir(exist_ok=True)
 
     # Definir nombres de columnas del CSV
     fieldnames = ['Filter Type', 'Implementation', 'Processing Time (seconds)']
@@ -53,11 +54,13 @@ def test_filters():
             ("Median Noise-reduction", lambda img: apply_median_filter(img, 3), output_noise_reduction)
         ]
 
+        elapsed_times = []
         for filter_name, filter_func, output_path in filters:
             print(f"\nTesting {filter_name} filter...")
-            start_time = time.time()
+            start_time = time.perf_counter_ns()
             filtered_image = filter_func(image)
-            elapsed_time = time.time() - start_time
+            elapsed_time = (time.perf_counter_ns() - start_time) / 1e9
+            elapsed_times.append(elapsed_time)
             save_image(filtered_image, output_path)
             print(f"{filter_name} filter processing time: {elapsed_time:.4f} seconds")
             
@@ -68,7 +71,7 @@ def test_filters():
     print("\nSummary:")
     print(f"{'Filter Type':<20} {'Processing Time':>15}")
     print("-" * 35)
-    for filter_name, _, _ in filters:
+    for (filter_name, _, _), elapsed_time in zip(filters, elapsed_times):
         print(f"{filter_name:<20} {elapsed_time:>15.4f}s")
     print("Cython finished")
 
@@ -15,6 +15,8 @@ def test_filters() -> None:
     
     # Prepare CSV for writing results
     csv_file = 'metrics/values.csv'
+    os.makedirs('metrics', exist_ok=True)
+    os.makedirs('numpy_dir', exist_ok=True)
     fieldnames = ['Filter Type', 'Implementation', 'Processing Time (seconds)']
     
     # Check if file exists and is not empty
@@ -33,28 +35,28 @@ def test_filters() -> None:
         
         # Test Sobel filter
         print("\nTesting Sobel filter...")
-        start_time = time.time()
+        start_time = time.perf_counter_ns()
         sobel_image = apply_sobel(image)  # Implementación en Numpy
-        sobel_time = time.time() - start_time
+        sobel_time = (time.perf_counter_ns() - start_time) / 1e9
         save_image(sobel_image, output_sobel)
         print(f"Sobel filter processing time: {sobel_time:.4f} seconds")
         writer.writerow({'Filter Type': 'Sobel', 'Implementation': 'Numpy', 'Processing Time (seconds)': sobel_time})
         
         # Test Gaussian filter
         print("\nTesting Gaussian filter...")
-        start_time = time.time()
+        start_time = time.perf_counter_ns()
         kernel = create_gaussian_kernel(9, sigma=3)  # nxn kernel
         gaussian_image = apply_filter(image, kernel)  # Implementación en Numpy
-        gaussian_time = time.time() - start_time
+        gaussian_time = (time.perf_counter_ns() - start_time) / 1e9
         save_image(gaussian_image, output_gaussian)
         print(f"Gaussian filter processing time: {gaussian_time:.4f} seconds")
         writer.writerow({'Filter Type': 'Gaussian', 'Implementation': 'Numpy', 'Processing Time (seconds)': gaussian_time})
 
         # Test median noise-reduction filter
         print("\nTesting Median noise-reduction filter...")
-        start_time = time.time()
+        start_time = time.perf_counter_ns()
         noise_reduction_image = apply_median_filter(image, 3)  # 3x3 median filter
-        noise_reduction_time = time.time() - start_time
+        noise_reduction_time = (time.perf_counter_ns() - start_time) / 1e9
         save_image(noise_reduction_image, output_noise_reduction)
         print(f"Median noise-reduction filter processing time: {noise_reduction_time:.4f} seconds")
         writer.writerow({'Filter Type': 'Median Noise-reduction', 'Implementation': 'Numpy', 'Processing Time (seconds)': noise_reduction_time})